@@ -99,6 +99,31 @@ DATABASES = {
 }
 
 
+# Cache
+# Общий кэш в Redis, без CACHE_LOCATION используется локальная память процесса
+
+CACHE_LOCATION = os.getenv('CACHE_LOCATION')
+
+if CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_LOCATION,
+        }
+    }
+
+
+# Хеширование паролей: число итераций PBKDF2 (без PASSWORD_HASH_ITERATIONS - значение Django по умолчанию)
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 0))
+
+PASSWORD_HASHERS = [
+    'users.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -145,13 +170,39 @@ AUTH_USER_MODEL = 'users.User'
 # Настройки JWT-токенов
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
+    ],
+    # Ошибки пакетных операций возвращаются словарем {номер элемента: ошибки}
+    'LIST_SERIALIZER_ERRORS_AS_DICT': True,
 }
 
+# Время жизни (в секундах) юзера в кэше аутентификации по JWT-токену
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 60))
+
+# Количество юзеров, читаемых из БД за одну порцию при потоковой выгрузке списка юзеров
+USER_EXPORT_CHUNK_SIZE = int(os.getenv('USER_EXPORT_CHUNK_SIZE', 2000))
+
+# Количество привычек, удаляемых за одну транзакцию при удалении юзера
+USER_DELETE_BATCH_SIZE = int(os.getenv('USER_DELETE_BATCH_SIZE', 1000))
+
+# Пагинация списков привычек по умолчанию: page - постраничная, cursor - курсорная
+HABIT_PAGINATION = os.getenv('HABIT_PAGINATION', 'page')
+
+# Максимальное количество привычек в одном запросе пакетного создания и обновления
+HABIT_BULK_MAX_SIZE = int(os.getenv('HABIT_BULK_MAX_SIZE', 100))
+
+# Количество привычек, читаемых из БД за одну порцию при потоковой выгрузке
+HABIT_EXPORT_CHUNK_SIZE = int(os.getenv('HABIT_EXPORT_CHUNK_SIZE', 2000))
+
+# Количество записей в одной порции импорта привычек командой import_habits
+HABIT_IMPORT_BATCH_SIZE = int(os.getenv('HABIT_IMPORT_BATCH_SIZE', 1000))
+
+# Время жизни (в секундах) закэшированных страниц списка публичных привычек
+HABIT_PUBLIC_FEED_CACHE_TIMEOUT = int(os.getenv('HABIT_PUBLIC_FEED_CACHE_TIMEOUT', 60))
+
 # Настройки срока действия токенов
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
@@ -160,6 +211,22 @@ SIMPLE_JWT = {
 
 TG_BOT_TOKEN = os.getenv('TG_BOT_TOKEN')
 
+# Настройки HTTP-клиента Telegram
+TG_API_URL = os.getenv('TG_API_URL', 'https://api.telegram.org')
+TG_POOL_SIZE = int(os.getenv('TG_POOL_SIZE', 10))
+TG_CONNECT_TIMEOUT = float(os.getenv('TG_CONNECT_TIMEOUT', 3.05))
+TG_READ_TIMEOUT = float(os.getenv('TG_READ_TIMEOUT', 10))
+TG_MAX_RETRIES = int(os.getenv('TG_MAX_RETRIES', 3))
+
+# Параллельная рассылка: число потоков, лимиты Telegram (сообщений в секунду всего и в один чат),
+# сохранение порядка сообщений внутри чата и число повторов после ответа 429.
+# Лимиты и пауза после 429 хранятся в кэше: для общего лимита на все воркеры нужен CACHE_LOCATION (Redis)
+TG_SEND_WORKERS = int(os.getenv('TG_SEND_WORKERS', 8))
+TG_RATE_LIMIT = float(os.getenv('TG_RATE_LIMIT', 30))
+TG_CHAT_RATE_LIMIT = float(os.getenv('TG_CHAT_RATE_LIMIT', 1))
+TG_PRESERVE_CHAT_ORDER = os.getenv('TG_PRESERVE_CHAT_ORDER', 'True') == 'True'
+TG_FLOOD_RETRIES = int(os.getenv('TG_FLOOD_RETRIES', 3))
+
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
 
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
@@ -169,8 +236,26 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'habit.tasks.send_notification_tg',
         'schedule': timedelta(minutes=1),  # Каждую минуту
     },
+    'deliver_notifications': {
+        'task': 'habit.tasks.deliver_notifications',
+        'schedule': timedelta(minutes=1),  # Каждую минуту
+    },
+    'link_tg_chat_ids': {
+        'task': 'habit.tasks.link_tg_chat_ids',
+        'schedule': timedelta(minutes=1),  # Каждую минуту
+    },
 }
 
+# Количество привычек в одной подзадаче рассылки уведомлений
+HABIT_DISPATCH_BATCH_SIZE = int(os.getenv('HABIT_DISPATCH_BATCH_SIZE', 500))
+
+# Доставка уведомлений из очереди: размер подзадачи, срок захвата уведомления воркером (в секундах),
+# число попыток до признания уведомления недоставленным и базовая задержка между попытками (в секундах)
+NOTIFICATION_DELIVERY_BATCH_SIZE = int(os.getenv('NOTIFICATION_DELIVERY_BATCH_SIZE', 500))
+NOTIFICATION_DELIVERY_LEASE = int(os.getenv('NOTIFICATION_DELIVERY_LEASE', 300))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5))
+NOTIFICATION_RETRY_BACKOFF = int(os.getenv('NOTIFICATION_RETRY_BACKOFF', 60))
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:8000',
 ]
@@ -1,5 +1,28 @@
+from django import forms
 from django.contrib import admin
 
-from habit.models import Habit
+from habit.models import Habit, NotificationOutbox
+from habit.validators import habit_validator
 
-admin.site.register(Habit)
+
+class HabitAdminForm(forms.ModelForm):
+    """Форма привычки в админке с проверкой теми же правилами, что и в API"""
+
+    class Meta:
+        model = Habit
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        errors = habit_validator.validate(cleaned_data, self.instance if self.instance.pk else None)
+        if errors:
+            raise forms.ValidationError(errors)
+        return cleaned_data
+
+
+@admin.register(Habit)
+class HabitAdmin(admin.ModelAdmin):
+    form = HabitAdminForm
+
+
+admin.site.register(NotificationOutbox)
@@ -0,0 +1,54 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: записанная строка сразу возвращается, а не накапливается"""
+
+    def write(self, value):
+        return value
+
+
+def iter_ndjson(rows):
+    """Строки выгрузки в формате NDJSON: один JSON-объект на строку"""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def iter_csv(rows, fields):
+    """Строки выгрузки в формате CSV с заголовком из списка полей"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def iter_serialized(queryset, serializer, chunk_size):
+    """Сериализация выборки по одной записи с чтением из БД серверным курсором порциями по chunk_size.
+
+    Один экземпляр сериализатора на всю выгрузку: поля строятся один раз, а не для каждой записи.
+    """
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        yield serializer.to_representation(instance)
+
+
+def stream_export(queryset, serializer_class, export_format, chunk_size, filename):
+    """Потоковая выгрузка выборки в NDJSON или CSV, память не зависит от количества записей"""
+    serializer = serializer_class()
+    rows = iter_serialized(queryset, serializer, chunk_size)
+    if export_format == 'csv':
+        content = iter_csv(rows, list(serializer.fields))
+    else:
+        content = iter_ndjson(rows)
+
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
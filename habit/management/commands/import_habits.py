@@ -0,0 +1,263 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.serializers import as_serializer_error
+
+from habit.models import Habit
+from habit.serializers import HabitSerializer
+from habit.services import bump_public_feed_version
+from habit.validators import habit_validator
+from users.models import User
+from users.validators import validate_timezone
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+LINKED_NOT_FOUND = 'Связанная привычка не найдена среди импортированных записей.'
+
+
+class InvalidRecord:
+    """Запись, которую не удалось прочитать: ошибка выводится по ее номеру, импорт продолжается"""
+
+    def __init__(self, errors):
+        self.errors = errors
+
+
+def read_ndjson(file):
+    """Записи из NDJSON-файла по одной, пустые строки пропускаются"""
+    for line in file:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as error:
+            yield InvalidRecord({'non_field_errors': [f'Некорректный JSON: {error.msg} (позиция {error.pos}).']})
+
+
+def read_csv(file):
+    """Записи из CSV-файла по одной, пустые значения считаются незаполненными"""
+    for row in csv.DictReader(file):
+        yield {field: value if value != '' else None for field, value in row.items()}
+
+
+def read_checkpoint(path):
+    """Количество записей, обработанных при предыдущем запуске, и id созданных привычек по id из файла"""
+    if not path or not os.path.exists(path):
+        return 0, {}
+    with open(path) as file:
+        checkpoint = json.load(file)
+    return checkpoint['processed'], checkpoint.get('ids', {})
+
+
+def write_checkpoint(path, processed, ids):
+    """Сохранение количества обработанных записей и id созданных привычек с атомарной заменой файла"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'processed': processed, 'ids': ids}, file)
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт привычек из NDJSON или CSV порциями с сохранением прогресса'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с привычками')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Формат файла, по умолчанию по расширению')
+        parser.add_argument('--batch-size', type=int, default=settings.HABIT_IMPORT_BATCH_SIZE,
+                            help='Количество записей в одной порции')
+        parser.add_argument('--checkpoint', help='Файл прогресса: при повторном запуске импорт продолжится с него')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Создавать владельцев, которых нет в базе (по email из поля owner)')
+        parser.add_argument('--linked-by-pk', action='store_true',
+                            help='Считать поле linked id привычки в этой базе, а не id записи из файла')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f'Неизвестный формат файла: {import_format}')
+        if options['batch_size'] < 1:
+            raise CommandError('Размер порции должен быть больше 0')
+
+        self.create_users = options['create_users']
+        self.linked_by_pk = options['linked_by_pk']
+        checkpoint = options['checkpoint']
+        processed, self.ids = read_checkpoint(checkpoint)
+        created = failed = 0
+        started = time.monotonic()
+
+        with open(path, newline='', encoding='utf-8') as file:
+            records = read_csv(file) if import_format == 'csv' else read_ndjson(file)
+            records = islice(records, processed, None)
+
+            while batch := list(islice(records, options['batch_size'])):
+                batch_created, errors = self.import_batch(batch)
+
+                for number, error in errors:
+                    self.stderr.write(f'Запись {processed + number + 1}: {json.dumps(error, ensure_ascii=False)}')
+
+                processed += len(batch)
+                created += batch_created
+                failed += len(errors)
+                if checkpoint:
+                    write_checkpoint(checkpoint, processed, self.ids)
+
+                rate = (created + failed) / max(time.monotonic() - started, 1e-9)
+                self.stdout.write(
+                    f'Обработано записей: {processed}, создано привычек: {created}, с ошибками: {failed} '
+                    f'({rate:.0f} записей/с)'
+                )
+
+        self.stdout.write(self.style.SUCCESS(f'Импорт завершен: создано привычек {created}, с ошибками {failed}'))
+
+    def get_owners(self, batch):
+        """Владельцы привычек порции одним запросом по email или id, недостающие создаются при --create-users.
+
+        Возвращает владельцев по email и id, а также ошибки создания владельцев по email.
+        """
+        keys = {str(record.get('owner') or '') for record in batch}
+        emails = {key for key in keys if '@' in key}
+        pks = {int(key) for key in keys if key.isdigit()}
+
+        owners = {}
+        for user in User.objects.filter(email__in=emails) | User.objects.filter(pk__in=pks):
+            owners[user.email] = owners[str(user.pk)] = user
+
+        owner_errors = {}
+        missing = {email for email in emails if email not in owners}
+        if self.create_users and missing:
+            records = {}
+            for record in batch:
+                if record.get('owner') in missing:
+                    records.setdefault(record['owner'], record)
+
+            users = []
+            for email in sorted(missing):
+                user = User(
+                    email=email,
+                    tg_username=records[email].get('tg_username') or '',
+                    timezone=records[email].get('timezone') or 'UTC',
+                )
+                try:
+                    validate_timezone(user.timezone)
+                except ValidationError as error:
+                    owner_errors[email] = {'timezone': error.messages}
+                    continue
+                user.set_unusable_password()
+                users.append(user)
+
+            User.objects.bulk_create(users)
+            owners.update({user.email: user for user in users})
+
+        return owners, owner_errors
+
+    def import_batch(self, batch):
+        """Проверка и запись одной порции: возвращает число созданных привычек и ошибки по номерам записей"""
+        # Один экземпляр сериализатора на порцию: поля строятся один раз, а не для каждой записи.
+        # Правила привычки проверяются сразу для всей порции через habit_validator.validate_many
+        serializer = HabitSerializer()
+        serializer.validators = []
+
+        errors = []
+        records = []
+        for number, record in enumerate(batch):
+            if isinstance(record, InvalidRecord):
+                errors.append((number, record.errors))
+            elif not isinstance(record, dict):
+                message = serializer.error_messages['invalid'].format(datatype=type(record).__name__)
+                errors.append((number, {'non_field_errors': [message]}))
+            else:
+                records.append((number, record))
+
+        habits = []
+        with transaction.atomic():
+            owners, owner_errors = self.get_owners([record for _, record in records])
+
+            # Записи, связанные с еще не созданными привычками той же порции, создаются следующим проходом
+            while records:
+                ready, records = self.resolve_linked(records, errors)
+                if not ready:
+                    break
+                habits += self.create_habits(ready, owners, owner_errors, serializer, errors)
+
+        if any(habit.is_public for habit in habits):
+            bump_public_feed_version()
+        return len(habits), sorted(errors, key=lambda error: error[0])
+
+    def resolve_linked(self, records, errors):
+        """Замена поля linked из файла на id созданной привычки по id записи из файла.
+
+        Возвращает записи, готовые к созданию, и записи, ожидающие создания связанной привычки из той же порции.
+        С --linked-by-pk поле linked считается id привычки в этой базе.
+        """
+        if self.linked_by_pk:
+            return records, []
+
+        pending_ids = {str(record['id']) for _, record in records if record.get('id') is not None}
+        ready = []
+        deferred = []
+        for number, record in records:
+            linked = record.get('linked')
+            if linked is None or linked == '':
+                ready.append((number, record))
+            elif str(linked) in self.ids:
+                ready.append((number, {**record, 'linked': self.ids[str(linked)]}))
+            elif str(linked) in pending_ids and str(linked) != str(record.get('id')):
+                deferred.append((number, record))
+            else:
+                errors.append((number, {'linked': [LINKED_NOT_FOUND]}))
+
+        if not ready:
+            errors.extend((number, {'linked': [LINKED_NOT_FOUND]}) for number, _ in deferred)
+            deferred = []
+        return ready, deferred
+
+    def create_habits(self, records, owners, owner_errors, serializer, errors):
+        """Проверка и создание привычек из записей одним bulk_create, id созданных запоминаются по id из файла"""
+        linked_pks = set()
+        for _, record in records:
+            try:
+                linked_pks.add(int(record.get('linked')))
+            except (TypeError, ValueError):
+                continue
+        serializer.context['linked_habits'] = Habit.objects.in_bulk(linked_pks)
+
+        rows = []
+        for number, record in records:
+            owner_key = str(record.get('owner') or '')
+            owner = owners.get(owner_key)
+            if owner is None:
+                errors.append((number, owner_errors.get(owner_key, {'owner': ['Пользователь не найден.']})))
+                continue
+
+            try:
+                rows.append((number, record.get('id'), owner, serializer.run_validation(record)))
+            except serializers.ValidationError as error:
+                errors.append((number, as_serializer_error(error)))
+
+        habits = []
+        source_ids = []
+        rule_errors = habit_validator.validate_many([validated_data for _, _, _, validated_data in rows])
+        for (number, source_id, owner, validated_data), habit_errors in zip(rows, rule_errors):
+            if habit_errors:
+                errors.append((number, {'non_field_errors': habit_errors}))
+                continue
+
+            habit = Habit(owner=owner, **validated_data)
+            habit.next_dispatch_at = habit.calc_next_dispatch_at()
+            habits.append(habit)
+            source_ids.append(source_id)
+
+        Habit.objects.bulk_create(habits)
+
+        for source_id, habit in zip(source_ids, habits):
+            if source_id is not None and source_id != '':
+                self.ids[str(source_id)] = habit.pk
+        return habits
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_next_dispatch_at(apps, schema_editor):
+    Habit = apps.get_model('habit', 'Habit')
+    today = timezone.localdate()
+
+    batch = []
+    for habit in Habit.objects.only('time', 'period', 'last_dispatch_time').iterator(chunk_size=1000):
+        if habit.last_dispatch_time:
+            habit.next_dispatch_at = habit.last_dispatch_time + timedelta(days=habit.period)
+        else:
+            habit.next_dispatch_at = timezone.make_aware(datetime.combine(today, habit.time))
+        batch.append(habit)
+
+        if len(batch) >= 1000:
+            Habit.objects.bulk_update(batch, ['next_dispatch_at'])
+            batch = []
+
+    Habit.objects.bulk_update(batch, ['next_dispatch_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0002_habit_last_dispatch_time'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='next_dispatch_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время следующей отправки'),
+        ),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(fields=['next_dispatch_at', 'id'], name='habit_next_dispatch_idx'),
+        ),
+        migrations.RunPython(fill_next_dispatch_at, migrations.RunPython.noop),
+    ]
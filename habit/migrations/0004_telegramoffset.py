@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0003_habit_next_dispatch_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramOffset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('update_id', models.BigIntegerField(default=0, verbose_name='Идентификатор обновления')),
+            ],
+            options={
+                'verbose_name': 'Смещение обновлений Telegram',
+                'verbose_name_plural': 'Смещения обновлений Telegram',
+            },
+        ),
+    ]
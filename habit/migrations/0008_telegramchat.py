@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0007_habit_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramChat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True, verbose_name='Telegram username')),
+                ('chat_id', models.BigIntegerField(verbose_name='Telegram chat id')),
+            ],
+            options={
+                'verbose_name': 'Чат Telegram',
+                'verbose_name_plural': 'Чаты Telegram',
+            },
+        ),
+    ]
@@ -1,4 +1,8 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
 from django.db import models
+from django.utils import timezone
 
 from users.models import User
 
@@ -7,7 +11,8 @@ NULLABLE = {'null': True, 'blank': True}
 
 class Habit(models.Model):
     """Класс - Привычка"""
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Создатель привычки', **NULLABLE)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Создатель привычки', db_index=False,
+                              **NULLABLE)
 
     place = models.CharField(max_length=100, verbose_name='Место выполнения привычки')
     time = models.TimeField(verbose_name='Время выполнения привычки')
@@ -19,10 +24,116 @@ class Habit(models.Model):
     length = models.SmallIntegerField(verbose_name='Время на выполнение')
     is_public = models.BooleanField(verbose_name='Признак публикации')
     last_dispatch_time = models.DateTimeField(verbose_name='Время последней отправки', **NULLABLE)
+    next_dispatch_at = models.DateTimeField(verbose_name='Время следующей отправки', **NULLABLE)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения')
 
     def __str__(self):
         return f'{self.action}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем признак публикации, чтобы при снятии с публикации сбросить кэш публичного списка
+        instance._loaded_is_public = instance.__dict__.get('is_public', False)
+        return instance
+
+    def calc_next_dispatch_at(self, after=None):
+        """Расчет времени следующей отправки уведомления с точностью до минуты в часовом поясе владельца.
+
+        С after - ближайшее время привычки позже него, без учета последней отправки.
+        """
+        owner_tz = ZoneInfo(self.owner.timezone) if self.owner else timezone.get_default_timezone()
+        habit_time = self._meta.get_field('time').to_python(self.time).replace(second=0, microsecond=0)
+
+        if after is not None:
+            dispatch_date = timezone.localdate(after, owner_tz)
+            dispatch_at = timezone.make_aware(datetime.combine(dispatch_date, habit_time), owner_tz)
+            if dispatch_at > after:
+                return dispatch_at
+            dispatch_date += timedelta(days=1)
+        elif self.last_dispatch_time:
+            dispatch_date = timezone.localdate(self.last_dispatch_time, owner_tz) + timedelta(days=int(self.period))
+        else:
+            dispatch_date = timezone.localdate(timezone=owner_tz)
+
+        return timezone.make_aware(datetime.combine(dispatch_date, habit_time), owner_tz)
+
+    def save(self, *args, **kwargs):
+        self.next_dispatch_at = self.calc_next_dispatch_at()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'next_dispatch_at', 'updated_at'}
+
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Привычка'
         verbose_name_plural = 'Привычки'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['next_dispatch_at', 'id'], name='habit_next_dispatch_idx'),
+            # Индекс на owner_id заменяет составной индекс для списка привычек владельца
+            models.Index(fields=['owner', 'id'], name='habit_owner_id_idx'),
+            models.Index(fields=['id'], condition=models.Q(is_public=True), name='habit_public_id_idx'),
+        ]
+
+
+class TelegramOffset(models.Model):
+    """Класс - Последнее обработанное обновление бота Telegram"""
+    update_id = models.BigIntegerField(default=0, verbose_name='Идентификатор обновления')
+
+    def __str__(self):
+        return f'{self.update_id}'
+
+    class Meta:
+        verbose_name = 'Смещение обновлений Telegram'
+        verbose_name_plural = 'Смещения обновлений Telegram'
+
+
+class TelegramChat(models.Model):
+    """Класс - Чат Telegram, написавший боту: хранится, пока не зарегистрируется юзер с таким username"""
+    username = models.CharField(max_length=150, unique=True, verbose_name='Telegram username')
+    chat_id = models.BigIntegerField(verbose_name='Telegram chat id')
+
+    def __str__(self):
+        return f'{self.username}'
+
+    class Meta:
+        verbose_name = 'Чат Telegram'
+        verbose_name_plural = 'Чаты Telegram'
+
+
+class NotificationOutbox(models.Model):
+    """Класс - Уведомление в очереди на отправку в telegram"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_DEAD, 'Не доставлено'),
+    ]
+
+    habit = models.ForeignKey(Habit, on_delete=models.CASCADE, verbose_name='Привычка')
+    chat_id = models.BigIntegerField(verbose_name='Telegram chat id')
+    text = models.TextField(verbose_name='Текст уведомления')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Статус')
+    attempts = models.SmallIntegerField(default=0, verbose_name='Количество попыток')
+    next_attempt_at = models.DateTimeField(verbose_name='Время следующей попытки')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
+    sent_at = models.DateTimeField(verbose_name='Время отправки', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.habit_id}: {self.status}'
+
+    class Meta:
+        verbose_name = 'Уведомление'
+        verbose_name_plural = 'Уведомления'
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                condition=models.Q(status='pending'),
+                name='outbox_pending_idx',
+            ),
+        ]
@@ -1,4 +1,5 @@
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class HabitPaginator(PageNumberPagination):
@@ -6,3 +7,22 @@ class HabitPaginator(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
     max_page_size = 10
+
+
+class HabitCursorPaginator(CursorPagination):
+    """Курсорный пагинатор для вывода списка привычек: без COUNT(*) и OFFSET, поиск по индексу id"""
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 10
+    ordering = 'id'
+
+
+def get_habit_paginator(request):
+    """Выбор пагинатора по параметру запроса 'pagination' (page или cursor) или настройке HABIT_PAGINATION"""
+    mode = settings.HABIT_PAGINATION
+    if request is not None:
+        mode = request.query_params.get('pagination', mode)
+
+    if mode == 'cursor':
+        return HabitCursorPaginator()
+    return HabitPaginator()
@@ -1,19 +1,163 @@
+from functools import lru_cache
+
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from habit.models import Habit
-from habit.validators import RewardOrLinkedValidator, ExecutionDurationValidator, LinkedHabitsValidator, \
-    PleasantHabitValidator, PeriodValidator
+from habit.services import bump_public_feed_version
+from habit.validators import habit_validator
+
+
+class LinkedHabitField(serializers.PrimaryKeyRelatedField):
+    """Поле связанной привычки: при пакетной обработке берет привычки, загруженные одним запросом"""
+    def to_internal_value(self, data):
+        linked_habits = self.context.get('linked_habits')
+        if linked_habits is None:
+            return super().to_internal_value(data)
+
+        try:
+            return linked_habits[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class HabitBulkSerializer(serializers.ListSerializer):
+    """Сериализатор списка привычек для пакетного создания и обновления в одной транзакции"""
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            linked_pks = set()
+            for item in data:
+                try:
+                    linked_pks.add(int(item.get('linked')))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+            self.context['linked_habits'] = Habit.objects.in_bulk(linked_pks)
+
+        if self.instance is not None:
+            self._instances = {habit.pk: habit for habit in self.instance}
+
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.child.instance = None
+
+    def run_child_validation(self, data):
+        if self.instance is None:
+            return super().run_child_validation(data)
+
+        try:
+            self.child.instance = self._instances[int(data.get('id'))]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise serializers.ValidationError({'id': ['Привычка не найдена.']})
+
+        validated = super().run_child_validation(data)
+        validated['id'] = self.child.instance.pk
+        return validated
+
+    def create(self, validated_data):
+        habits = [Habit(**attrs) for attrs in validated_data]
+        for habit in habits:
+            habit.next_dispatch_at = habit.calc_next_dispatch_at()
+
+        with transaction.atomic():
+            habits = Habit.objects.bulk_create(habits)
+
+        if any(habit.is_public for habit in habits):
+            bump_public_feed_version()
+        return habits
+
+    def update(self, instance, validated_data):
+        instances = {habit.pk: habit for habit in instance}
+        now = timezone.now()
+
+        habits = []
+        fields = {'next_dispatch_at', 'updated_at'}
+        touches_public = False
+        for attrs in validated_data:
+            habit = instances[attrs.pop('id')]
+            touches_public |= habit.is_public
+
+            for attr, value in attrs.items():
+                setattr(habit, attr, value)
+            habit.next_dispatch_at = habit.calc_next_dispatch_at()
+            habit.updated_at = now
+            touches_public |= habit.is_public
+
+            habits.append(habit)
+            fields.update(attrs)
+
+        with transaction.atomic():
+            Habit.objects.bulk_update(habits, fields)
+
+        if touches_public:
+            bump_public_feed_version()
+        return habits
 
 
 class HabitSerializer(serializers.ModelSerializer):
     """Сериализатор модели Habit"""
+    linked = LinkedHabitField(queryset=Habit.objects.all(), label='Связанная привычка', allow_null=True,
+                              required=False)
+
     class Meta:
         model = Habit
         fields = '__all__'
-        validators = [
-            RewardOrLinkedValidator(reward='reward', linked='linked',),
-            ExecutionDurationValidator(length='length',),
-            LinkedHabitsValidator(linked='linked',),
-            PleasantHabitValidator(reward='reward', linked='linked', is_pleasant='is_pleasant',),
-            PeriodValidator(period='period')
-        ]
+        read_only_fields = ('owner', 'next_dispatch_at')
+        list_serializer_class = HabitBulkSerializer
+        validators = [habit_validator]
+
+    def update(self, instance, validated_data):
+        """Обновление привычки с записью в базу только переданных полей"""
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+
+        instance.save(update_fields=validated_data.keys())
+        return instance
+
+
+@lru_cache(maxsize=None)
+def get_habit_read_fields():
+    """Поля HabitSerializer для чтения: для даты и времени - функция форматирования DRF, остальные выводятся как есть"""
+    return {
+        name: field.to_representation if isinstance(field, (serializers.DateTimeField, serializers.TimeField)) else None
+        for name, field in HabitSerializer().fields.items()
+        if not field.write_only
+    }
+
+
+class HabitValuesSerializer:
+    """Облегченный сериализатор списков привычек из строк values() без создания моделей и полей DRF.
+
+    Формат вывода совпадает с HabitSerializer, набор полей можно ограничить (?fields=action,time).
+    """
+    def __init__(self, fields=None):
+        read_fields = get_habit_read_fields()
+        fields = list(fields or read_fields)
+
+        unknown = [name for name in fields if name not in read_fields]
+        if unknown:
+            raise serializers.ValidationError({'fields': [f'Неизвестные поля: {", ".join(unknown)}.']})
+
+        self.formatters = [(name, read_fields[name]) for name in fields]
+
+    def get_values_fields(self):
+        """Поля для values(): выбранные поля и id, по которому работает курсорная пагинация"""
+        return {'id', *(name for name, _ in self.formatters)}
+
+    def to_representation(self, rows):
+        data = []
+        for row in rows:
+            item = {}
+            for name, formatter in self.formatters:
+                value = row[name]
+                item[name] = formatter(value) if formatter is not None and value is not None else value
+            data.append(item)
+        return data
+
+
+class HabitBulkDeleteSerializer(serializers.Serializer):
+    """Сериализатор списка id привычек для пакетного удаления"""
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
@@ -1,37 +1,354 @@
+import hashlib
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from habit.models import Habit, TelegramChat, TelegramOffset
+from users.authentication import invalidate_cached_users
+from users.models import User
+
+
+TELEGRAM_RATE_KEY = 'telegram:rate'
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов, общий для всех процессов и воркеров через кэш (Redis).
+
+    Время делится на интервалы длиной 1 / rate секунд, каждый запрос занимает свободный интервал
+    атомарной записью cache.add, поэтому лимит соблюдается суммарно всеми подзадачами рассылки
+    (rate - запросов в секунду, 0 - без ограничений). В интервале хранится момент отправки, чтобы
+    запрос из следующего интервала шел не раньше чем через 1 / rate секунд после него.
+    """
+    # Насколько далеко вперед (в секундах) можно занимать интервалы
+    horizon = 60
+
+    def __init__(self, key, rate, pause_key=None):
+        self.key = f'{key}:{rate}'
+        self.rate = rate
+        self.pause_key = pause_key or f'{key}:pause'
+
+    def get_slot(self, moment):
+        return int(moment * self.rate + 1e-6)
+
+    def get_slot_key(self, moment):
+        return f'{self.key}:{self.get_slot(moment)}'
+
+    def acquire(self, moment):
+        """Попытка занять интервал, в который попадает moment"""
+        return not self.rate or cache.add(self.get_slot_key(moment), moment, timeout=self.horizon * 2)
+
+    def move(self, moment):
+        """Перенос момента отправки внутри уже занятого интервала"""
+        if self.rate:
+            cache.set(self.get_slot_key(moment), moment, timeout=self.horizon * 2)
+
+    def get_earliest_moment(self, moment):
+        """Самый ранний момент отправки в интервале moment с учетом запроса из предыдущего интервала"""
+        if not self.rate:
+            return moment
+        previous = cache.get(f'{self.key}:{self.get_slot(moment) - 1}')
+        return max(moment, previous + 1 / self.rate) if previous is not None else moment
+
+    def release(self, moment):
+        if self.rate:
+            cache.delete(self.get_slot_key(moment))
+
+    def get_next_moment(self, moment):
+        """Начало следующего интервала после moment"""
+        return (self.get_slot(moment) + 1) / self.rate
+
+    def get_hint(self):
+        """Начало первого интервала, который может быть свободен"""
+        return cache.get(f'{self.key}:next', 0) / self.rate if self.rate else 0
 
+    def remember(self, moment):
+        if self.rate:
+            cache.set(f'{self.key}:next', self.get_slot(moment) + 1, timeout=self.horizon * 2)
 
-def checking_users_for_chat_id(tg_bot_token, users_):
-    """Проверка и запись поля tg_chat_id у юзера"""
-    get_updates_url = f'https://api.telegram.org/bot{tg_bot_token}/getUpdates'
-    response_json = requests.get(get_updates_url).json()
+    def wait(self):
+        """Ожидание своего интервала на отправку запроса"""
+        wait_for_slots(self)
 
-    usernames_r = {}
-    for resp in response_json['result']:
-        username = resp['message']['chat'].get('username')
-        chat_id = resp['message']['chat'].get('id')
-        usernames_r[username] = chat_id
+    def pause(self, seconds):
+        """Приостановка всех запросов с этим ключом паузы на заданное время"""
+        pause_until = time.time() + seconds
+        if pause_until > (cache.get(self.pause_key) or 0):
+            cache.set(self.pause_key, pause_until, timeout=math.ceil(seconds) + 1)
 
-    for user in users_:
-        if user.tg_chat_id is None:
-            user.tg_chat_id = usernames_r.get(user.tg_username)
-            user.save()
 
+def wait_for_slots(*limiters):
+    """Ожидание момента, свободного сразу во всех ограничителях (например, общем и лимите чата)"""
+    limiters = [limiter for limiter in limiters if limiter is not None]
+    now = time.time()
 
-def send_message(tg_bot_token, habit_):
-    """Функция для отправки сообщения в telegram"""
-    send_message_url = f'https://api.telegram.org/bot{tg_bot_token}/sendMessage'
+    moment = max([now] + [cache.get(limiter.pause_key) or 0 for limiter in limiters])
+    hint = max(limiter.get_hint() for limiter in limiters)
+    if moment < hint <= moment + RateLimiter.horizon:
+        moment = hint
 
-    message_tg = (f'Привет!\n'
-                  f'Вам нужно сделать: {habit_.action} в {habit_.time}\n'
-                  f'Место действия: {habit_.place}\n'
-                  f'Продолжительность действия: {habit_.length} сек.\n'
-                  f'Вознаграждение: {habit_.reward}')
+    while True:
+        acquired = []
+        for limiter in limiters:
+            if not limiter.acquire(moment):
+                for acquired_limiter in acquired:
+                    acquired_limiter.release(moment)
+                moment = limiter.get_next_moment(moment)
+                break
+            acquired.append(limiter)
+        else:
+            earliest = max(limiter.get_earliest_moment(moment) for limiter in limiters)
+            if all(limiter.get_slot(earliest) == limiter.get_slot(moment) for limiter in limiters):
+                if earliest > moment:
+                    for limiter in limiters:
+                        limiter.move(earliest)
+                    moment = earliest
+                break
+            # Момент с нужным отступом вышел за занятые интервалы: ищем свободные начиная с него
+            for limiter in limiters:
+                limiter.release(moment)
+            moment = earliest
 
-    if habit_.owner.tg_chat_id:
-        data_for_request = {
-            'chat_id': habit_.owner.tg_chat_id,
-            'text': message_tg
+    for limiter in limiters:
+        limiter.remember(moment)
+
+    if moment > now:
+        time.sleep(moment - now)
+
+
+class TelegramClient:
+    """Клиент Telegram Bot API с пулом keep-alive соединений"""
+    def __init__(self, token, api_url='https://api.telegram.org', pool_size=10,
+                 connect_timeout=3.05, read_timeout=10, retries=3, backoff_factor=0.5,
+                 workers=8, rate_limit=30, chat_rate_limit=1, preserve_chat_order=True, flood_retries=3):
+        self.base_url = f'{api_url}/bot{token}'
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.workers = workers
+        self.rate_limiter = RateLimiter(TELEGRAM_RATE_KEY, rate_limit)
+        self.chat_rate_limit = chat_rate_limit
+        self.preserve_chat_order = preserve_chat_order
+        self.flood_retries = flood_retries
+
+        # Ошибки соединения повторяются для всех запросов: запрос не дошел до Telegram. Ответы 502/503/504
+        # повторяются только для идемпотентных методов (getUpdates): шлюз мог ответить ошибкой, когда
+        # сообщение уже доставлено, поэтому sendMessage повторно отправляется только через очередь уведомлений
+        retry = Retry(
+            total=retries,
+            read=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, method, api_method, **kwargs):
+        return self.session.request(method, f'{self.base_url}/{api_method}', timeout=self.timeout, **kwargs)
+
+    def get_updates(self, offset=None):
+        """Получение списка обновлений бота начиная с offset"""
+        try:
+            response = self._request('GET', 'getUpdates', params={'offset': offset, 'allowed_updates': '["message"]'})
+            return response.json().get('result', [])
+        except (requests.RequestException, ValueError):
+            return []
+
+    def send_message(self, chat_id, text, chat_limiter=None):
+        """Отправка сообщения в чат, возвращает признак успешной отправки"""
+        for _ in range(self.flood_retries + 1):
+            wait_for_slots(self.rate_limiter, chat_limiter)
+
+            try:
+                response = self._request('POST', 'sendMessage', json={'chat_id': chat_id, 'text': text})
+            except requests.RequestException:
+                return False
+
+            if response.status_code != 429:
+                return response.ok
+
+            # Telegram просит подождать перед следующими запросами
+            try:
+                retry_after = response.json()['parameters']['retry_after']
+            except (ValueError, KeyError, TypeError):
+                retry_after = 1
+            self.rate_limiter.pause(retry_after)
+
+        return False
+
+    def send_many(self, messages):
+        """Параллельная отправка списка сообщений (chat_id, text), возвращает признаки отправки по порядку"""
+        results = [False] * len(messages)
+        # Пауза после ответа 429 общая для всех чатов, лимит чата - общий для всех подзадач
+        chat_limiters = {
+            chat_id: RateLimiter(f'{TELEGRAM_RATE_KEY}:chat:{chat_id}', self.chat_rate_limit, self.rate_limiter.pause_key)
+            for chat_id, _ in messages
         }
 
-        requests.get(send_message_url, data=data_for_request)
+        def send(indexes):
+            for index in indexes:
+                chat_id, text = messages[index]
+                results[index] = self.send_message(chat_id, text, chat_limiters[chat_id])
+
+        if self.preserve_chat_order:
+            # Сообщения одного чата уходят последовательно в исходном порядке
+            jobs = {}
+            for index, (chat_id, _) in enumerate(messages):
+                jobs.setdefault(chat_id, []).append(index)
+            jobs = list(jobs.values())
+        else:
+            jobs = [[index] for index in range(len(messages))]
+
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+                list(executor.map(send, jobs))
+
+        return results
+
+
+@lru_cache(maxsize=None)
+def get_telegram_client():
+    """Общий для процесса клиент Telegram, настроенный из settings"""
+    return TelegramClient(
+        settings.TG_BOT_TOKEN,
+        api_url=settings.TG_API_URL,
+        pool_size=settings.TG_POOL_SIZE,
+        connect_timeout=settings.TG_CONNECT_TIMEOUT,
+        read_timeout=settings.TG_READ_TIMEOUT,
+        retries=settings.TG_MAX_RETRIES,
+        workers=settings.TG_SEND_WORKERS,
+        rate_limit=settings.TG_RATE_LIMIT,
+        chat_rate_limit=settings.TG_CHAT_RATE_LIMIT,
+        preserve_chat_order=settings.TG_PRESERVE_CHAT_ORDER,
+        flood_retries=settings.TG_FLOOD_RETRIES,
+    )
+
+
+def link_users_chat_ids(client):
+    """Запись поля tg_chat_id юзерам без чата по сохраненным чатам Telegram и новым обновлениям бота.
+
+    Чаты из обновлений сохраняются вместе со смещением, поэтому юзер, написавший боту до регистрации,
+    будет привязан при следующем запуске после нее.
+    """
+    offset, _ = TelegramOffset.objects.get_or_create(pk=1)
+    updates = client.get_updates(offset=offset.update_id + 1)
+
+    if updates:
+        chats = {}
+        for update in updates:
+            chat = update.get('message', {}).get('chat', {})
+            if chat.get('username') and chat.get('id'):
+                chats[chat['username']] = chat['id']
+
+        # Чаты и смещение сохраняются вместе: подтвержденные Telegram обновления не теряются
+        with transaction.atomic():
+            TelegramChat.objects.bulk_create(
+                [TelegramChat(username=username, chat_id=chat_id) for username, chat_id in chats.items()],
+                update_conflicts=True,
+                unique_fields=['username'],
+                update_fields=['chat_id'],
+            )
+            last_update_id = max(update['update_id'] for update in updates)
+            TelegramOffset.objects.filter(pk=1, update_id__lt=last_update_id).update(update_id=last_update_id)
+
+    users = list(
+        User.objects.filter(tg_chat_id__isnull=True).annotate(
+            chat_id=Subquery(TelegramChat.objects.filter(username=OuterRef('tg_username')).values('chat_id')[:1])
+        ).filter(chat_id__isnull=False)
+    )
+    if not users:
+        return 0
+
+    taken_chat_ids = set(
+        User.objects.filter(tg_chat_id__in=[user.chat_id for user in users]).values_list('tg_chat_id', flat=True)
+    )
+    linked_users = []
+    for user in users:
+        if user.chat_id not in taken_chat_ids:
+            user.tg_chat_id = user.chat_id
+            taken_chat_ids.add(user.chat_id)
+            linked_users.append(user)
+
+    User.objects.bulk_update(linked_users, ['tg_chat_id'])
+    invalidate_cached_users([user.pk for user in linked_users])
+    resume_habits(linked_users)
+
+    return len(linked_users)
+
+
+def resume_habits(owners):
+    """Возобновление отправки привычек, снятых с нее, пока владелец не был связан с ботом.
+
+    Отправка начинается с ближайшего времени привычки, пропущенные уведомления не досылаются.
+    """
+    now = timezone.now()
+    habits = list(Habit.objects.filter(owner__in=owners, next_dispatch_at__isnull=True).select_related('owner'))
+    for habit_ in habits:
+        habit_.next_dispatch_at = habit_.calc_next_dispatch_at(after=now)
+        habit_.updated_at = now
+
+    Habit.objects.bulk_update(habits, ['next_dispatch_at', 'updated_at'], batch_size=500)
+
+    if any(habit_.is_public for habit_ in habits):
+        bump_public_feed_version()
+
+
+def build_message(habit_):
+    """Текст уведомления о привычке"""
+    return (f'Привет!\n'
+            f'Вам нужно сделать: {habit_.action} в {habit_.time}\n'
+            f'Место действия: {habit_.place}\n'
+            f'Продолжительность действия: {habit_.length} сек.\n'
+            f'Вознаграждение: {habit_.reward}')
+
+
+def reschedule_habits(owner):
+    """Пересчет времени следующей отправки всех привычек юзера, например после смены часового пояса"""
+    now = timezone.now()
+    habits = list(Habit.objects.filter(owner=owner))
+    for habit_ in habits:
+        habit_.owner = owner
+        habit_.next_dispatch_at = habit_.calc_next_dispatch_at()
+        habit_.updated_at = now
+
+    Habit.objects.bulk_update(habits, ['next_dispatch_at', 'updated_at'], batch_size=500)
+
+    if any(habit_.is_public for habit_ in habits):
+        bump_public_feed_version()
+
+
+PUBLIC_FEED_VERSION_KEY = 'habit:public_feed:version'
+
+
+def get_public_feed_cache_key(url):
+    """Ключ кэша страницы списка публичных привычек для текущей версии списка.
+
+    Ключ строится по полному адресу со схемой и хостом: в ответе абсолютные ссылки next и previous.
+    """
+    version = cache.get(PUBLIC_FEED_VERSION_KEY)
+    if version is None:
+        cache.add(PUBLIC_FEED_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(PUBLIC_FEED_VERSION_KEY)
+
+    return f'habit:public_feed:{version}:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def bump_public_feed_version():
+    """Инвалидация всех закэшированных страниц списка публичных привычек"""
+    try:
+        cache.incr(PUBLIC_FEED_VERSION_KEY)
+    except ValueError:
+        # Версия вытеснена из кэша - начинаем с заведомо новой
+        cache.set(PUBLIC_FEED_VERSION_KEY, time.time_ns(), timeout=None)
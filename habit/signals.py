@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from habit.models import Habit
+from habit.services import bump_public_feed_version
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def invalidate_public_feed(sender, instance, **kwargs):
+    """Сброс кэша списка публичных привычек при изменении публичной привычки"""
+    if instance.is_public or getattr(instance, '_loaded_is_public', False):
+        bump_public_feed_version()
+
+    instance._loaded_is_public = instance.is_public
+
+
+@receiver(pre_delete, sender=Habit)
+def unlink_habits(sender, instance, **kwargs):
+    """Отвязка привычек от удаляемой с обновлением времени изменения (для ETag и Last-Modified).
+
+    SET_NULL у поля linked обнуляет ссылку без updated_at, поэтому связи очищаются здесь заранее.
+    """
+    linked_habits = dict(Habit.objects.filter(linked=instance).values_list('pk', 'is_public'))
+    if not linked_habits:
+        return
+
+    Habit.objects.filter(pk__in=linked_habits).update(linked=None, updated_at=timezone.now())
+    if any(linked_habits.values()):
+        bump_public_feed_version()
@@ -1,35 +1,208 @@
+import logging
 from datetime import timedelta
 
-from celery import shared_task
+from celery import chord, shared_task
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
-from habit.models import Habit
-from habit.services import checking_users_for_chat_id, send_message
-from users.models import User
+from habit.models import Habit, NotificationOutbox
+from habit.services import build_message, bump_public_feed_version, get_telegram_client, link_users_chat_ids
+
+logger = logging.getLogger(__name__)
+
+
+def get_due_habits(now):
+    """Привычки, по которым наступило время отправки и владелец которых связан с ботом"""
+    return Habit.objects.filter(
+        next_dispatch_at__lte=now,
+        owner__tg_chat_id__isnull=False,
+    ).select_related('owner').order_by('pk')
+
+
+def get_pending_notifications(now):
+    """Уведомления из очереди, время попытки отправки которых наступило"""
+    return NotificationOutbox.objects.filter(
+        status=NotificationOutbox.STATUS_PENDING,
+        next_attempt_at__lte=now,
+    ).order_by('pk')
+
+
+def split_pk_ranges(queryset, chunk_size):
+    """Разбиение выборки на диапазоны id (lower_pk, upper_pk] по chunk_size записей"""
+    pks = queryset.values_list('pk', flat=True)
+
+    ranges = []
+    lower_pk = 0
+    while True:
+        upper_pk = pks.filter(pk__gt=lower_pk)[chunk_size - 1:chunk_size].first()
+        if upper_pk is None:
+            if pks.filter(pk__gt=lower_pk).exists():
+                ranges.append((lower_pk, None))
+            return ranges
+
+        ranges.append((lower_pk, upper_pk))
+        lower_pk = upper_pk
+
+
+def filter_pk_range(queryset, lower_pk, upper_pk):
+    """Ограничение выборки диапазоном id (lower_pk, upper_pk]"""
+    queryset = queryset.filter(pk__gt=lower_pk)
+    if upper_pk is not None:
+        queryset = queryset.filter(pk__lte=upper_pk)
+    return queryset
+
+
+def skip_unlinked_habits(now):
+    """Снятие с отправки наступивших привычек, владелец которых не связан с ботом.
+
+    Время следующей отправки обнуляется, чтобы привычки не оставались в диапазоне наступивших
+    на каждом запуске; после привязки чата его пересчитывает link_users_chat_ids.
+    """
+    habits = dict(
+        Habit.objects.filter(next_dispatch_at__lte=now, owner__tg_chat_id__isnull=True).values_list('pk', 'is_public')
+    )
+    if habits:
+        Habit.objects.filter(pk__in=habits).update(next_dispatch_at=None, updated_at=now)
+        if any(habits.values()):
+            bump_public_feed_version()
+    return len(habits)
 
 
 @shared_task
 def send_notification_tg():
-    """Проверка времени для отправки уведомлений и отправление в telegram"""
-    token = settings.TG_BOT_TOKEN
+    """Проверка времени для отправки уведомлений и распределение постановки в очередь по подзадачам"""
+    now = timezone.now()
+    skipped = skip_unlinked_habits(now)
+    ranges = split_pk_ranges(get_due_habits(now), settings.HABIT_DISPATCH_BATCH_SIZE)
+
+    if not ranges:
+        return aggregate_dispatch_results([], skipped=skipped)
 
-    habits = Habit.objects.all()
-    users = User.objects.all()
+    header = [enqueue_notification_chunk.s(lower_pk, upper_pk) for lower_pk, upper_pk in ranges]
+    chord(header)(aggregate_dispatch_results.s(skipped=skipped))
 
-    checking_users_for_chat_id(token, users)
 
+@shared_task
+def enqueue_notification_chunk(lower_pk, upper_pk=None):
+    """Постановка в очередь уведомлений по наступившим привычкам из диапазона id (lower_pk, upper_pk].
+
+    Захват привычек через SELECT ... FOR UPDATE SKIP LOCKED, запись уведомлений и перенос времени
+    следующей отправки выполняются в одной транзакции, поэтому параллельные запуски не создадут дублей.
+    """
     now = timezone.now()
+    habits = filter_pk_range(get_due_habits(now), lower_pk, upper_pk)
+
+    with transaction.atomic():
+        habits = list(habits.select_for_update(skip_locked=True, of=('self',))[:settings.HABIT_DISPATCH_BATCH_SIZE])
+
+        NotificationOutbox.objects.bulk_create([
+            NotificationOutbox(habit=habit, chat_id=habit.owner.tg_chat_id, text=build_message(habit), next_attempt_at=now)
+            for habit in habits
+        ])
+
+        for habit in habits:
+            habit.last_dispatch_time = now
+            habit.next_dispatch_at = habit.calc_next_dispatch_at()
+            habit.updated_at = now
+        Habit.objects.bulk_update(habits, ['last_dispatch_time', 'next_dispatch_at', 'updated_at'])
+
+    if any(habit.is_public for habit in habits):
+        bump_public_feed_version()
+
+    return {'queued': len(habits)}
+
+
+@shared_task
+def aggregate_dispatch_results(results, skipped=0):
+    """Сводный результат постановки уведомлений в очередь и запуск доставки"""
+    summary = {
+        'queued': sum(result['queued'] for result in results),
+        'skipped': skipped,
+    }
+    logger.info('Уведомления поставлены в очередь: %s', summary)
+
+    if summary['queued']:
+        deliver_notifications.delay()
 
-    for habit in habits:
+    return summary
 
-        if habit.last_dispatch_time:
-            if habit.last_dispatch_time <= now - timedelta(days=habit.period):
-                send_message(token, habit)
-                habit.last_dispatch_time = now
-                habit.save()
+
+@shared_task
+def deliver_notifications():
+    """Распределение доставки уведомлений из очереди по подзадачам"""
+    ranges = split_pk_ranges(get_pending_notifications(timezone.now()), settings.NOTIFICATION_DELIVERY_BATCH_SIZE)
+
+    if not ranges:
+        return aggregate_delivery_results([])
+
+    header = [deliver_notification_chunk.s(lower_pk, upper_pk) for lower_pk, upper_pk in ranges]
+    chord(header)(aggregate_delivery_results.s())
+
+
+def claim_pending_notifications(now, lower_pk, upper_pk, limit):
+    """Захват уведомлений из диапазона id, которые не доставляются другим воркером.
+
+    Строки блокируются через SELECT ... FOR UPDATE SKIP LOCKED, а время следующей попытки
+    переносится на срок аренды: если воркер упадет, уведомление будет отправлено повторно после него.
+    """
+    notifications = filter_pk_range(get_pending_notifications(now), lower_pk, upper_pk)
+
+    with transaction.atomic():
+        notifications = list(notifications.select_for_update(skip_locked=True)[:limit])
+        NotificationOutbox.objects.filter(pk__in=[notification.pk for notification in notifications]).update(
+            next_attempt_at=now + timedelta(seconds=settings.NOTIFICATION_DELIVERY_LEASE)
+        )
+
+    return notifications
+
+
+@shared_task
+def deliver_notification_chunk(lower_pk, upper_pk=None):
+    """Доставка уведомлений из очереди с id из диапазона (lower_pk, upper_pk]"""
+    now = timezone.now()
+
+    notifications = claim_pending_notifications(now, lower_pk, upper_pk, settings.NOTIFICATION_DELIVERY_BATCH_SIZE)
+    if not notifications:
+        return {'sent': 0, 'failed': 0, 'dead': 0}
+
+    results = get_telegram_client().send_many(
+        [(notification.chat_id, notification.text) for notification in notifications]
+    )
+
+    sent_pks = [notification.pk for notification, is_sent in zip(notifications, results) if is_sent]
+    failed_notifications = [notification for notification, is_sent in zip(notifications, results) if not is_sent]
+
+    dead = 0
+    for notification in failed_notifications:
+        notification.attempts += 1
+        if notification.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+            notification.status = NotificationOutbox.STATUS_DEAD
+            dead += 1
         else:
-            if habit.time <= now.time():
-                send_message(token, habit)
-                habit.last_dispatch_time = now
-                habit.save()
+            backoff = settings.NOTIFICATION_RETRY_BACKOFF * 2 ** (notification.attempts - 1)
+            notification.next_attempt_at = now + timedelta(seconds=backoff)
+
+    NotificationOutbox.objects.filter(pk__in=sent_pks).update(status=NotificationOutbox.STATUS_SENT, sent_at=now)
+    NotificationOutbox.objects.bulk_update(failed_notifications, ['attempts', 'status', 'next_attempt_at'])
+
+    return {'sent': len(sent_pks), 'failed': len(failed_notifications) - dead, 'dead': dead}
+
+
+@shared_task
+def aggregate_delivery_results(results):
+    """Сводный результат доставки уведомлений по всем подзадачам"""
+    summary = {
+        'sent': sum(result['sent'] for result in results),
+        'failed': sum(result['failed'] for result in results),
+        'dead': sum(result['dead'] for result in results),
+    }
+    logger.info('Доставка уведомлений завершена: %s', summary)
+
+    return summary
+
+
+@shared_task
+def link_tg_chat_ids():
+    """Привязка telegram-чатов к юзерам по новым обновлениям бота"""
+    return link_users_chat_ids(get_telegram_client())
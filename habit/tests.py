@@ -1,8 +1,34 @@
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from habit.models import Habit
+from config.celery import app as celery_app
+from habit.admin import HabitAdminForm
+from habit.models import Habit, NotificationOutbox, TelegramChat, TelegramOffset
+from habit.serializers import HabitSerializer, HabitValuesSerializer
+from habit.services import TelegramClient, link_users_chat_ids
+from habit.tasks import deliver_notification_chunk, deliver_notifications, enqueue_notification_chunk, \
+    get_due_habits, send_notification_tg, split_pk_ranges
+from habit.validators import HABIT_RULES, HabitValidator, habit_validator, validate_period
 from users.models import User
 
 
@@ -323,6 +349,8 @@ class HabitListTestCase(APITestCase):
                         "length": self.habit.length,
                         "is_public": self.habit.is_public,
                         "last_dispatch_time": None,
+                        "next_dispatch_at": self.habit.next_dispatch_at.isoformat().replace('+00:00', 'Z'),
+                        "updated_at": self.habit.updated_at.isoformat().replace('+00:00', 'Z'),
                         "owner": self.habit.owner.pk,
                         "linked": self.habit.linked
                     }
@@ -331,9 +359,156 @@ class HabitListTestCase(APITestCase):
         )
 
 
+class HabitCursorPaginationTestCase(APITestCase):
+    """TestCase на курсорную пагинацию списков привычек"""
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        for i in range(7):
+            Habit.objects.create(
+                owner=self.user,
+                place='Улица',
+                time='19:00:00',
+                action=f'Бег {i}',
+                is_pleasant=False,
+                period=7,
+                reward='Снижение веса',
+                length=120,
+                is_public=True
+            )
+
+    def test_habit_list_cursor(self):
+        """Test на курсорную пагинацию по параметру запроса без подсчета количества"""
+        self.client.force_authenticate(user=self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('habit:habit_list'), {'pagination': 'cursor'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.json())
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertFalse(any('COUNT(*)' in query['sql'] or 'OFFSET' in query['sql'] for query in queries))
+
+        response = self.client.get(response.json()['next'])
+
+        self.assertEqual([habit['action'] for habit in response.json()['results']], ['Бег 5', 'Бег 6'])
+        self.assertIsNone(response.json()['next'])
+
+    @override_settings(HABIT_PAGINATION='cursor')
+    def test_habit_public_list_cursor_by_settings(self):
+        """Test на курсорную пагинацию, включенную в настройках"""
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('habit:habit_public_list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.json())
+        self.assertIsNotNone(response.json()['next'])
+
+
+class HabitValuesListTestCase(APITestCase):
+    """TestCase на облегченный вывод списков привычек и выбор полей"""
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.habits = [
+            Habit.objects.create(
+                owner=self.user,
+                place='Улица',
+                time='19:00',
+                action=f'Бег {number}',
+                is_pleasant=False,
+                period=1,
+                reward='Отдых',
+                length=120,
+                is_public=True,
+                last_dispatch_time=timezone.now() if number % 2 else None
+            )
+            for number in range(6)
+        ]
+
+    def test_habit_list_fields(self):
+        """Test на вывод только выбранных полей привычек"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_list'), {'fields': 'action,time'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json()['results'],
+            [{'action': habit.action, 'time': '19:00:00'} for habit in self.habits[:5]]
+        )
+
+    def test_habit_public_list_fields_cursor(self):
+        """Test на выбор полей публичных привычек при курсорной пагинации"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_public_list'), {'fields': 'action', 'pagination': 'cursor'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0], {'action': 'Бег 0'})
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.json()['results'], [{'action': 'Бег 5'}])
+
+    def test_habit_list_unknown_fields(self):
+        """Test на запрос неизвестных полей"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_list'), {'fields': 'action,password'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'fields': ['Неизвестные поля: password.']})
+
+    def test_habit_values_serializer_benchmark(self):
+        """Test на совпадение вывода с HabitSerializer и замер выборки и сериализации обоих вариантов"""
+        Habit.objects.bulk_create([
+            Habit(owner=self.user, place='Дом', time='08:00', action='Зарядка', is_pleasant=True, period=1,
+                  length=60, is_public=False, next_dispatch_at=timezone.now(), last_dispatch_time=timezone.now())
+            for _ in range(500)
+        ])
+        queryset = Habit.objects.filter(owner=self.user)
+        lean_serializer = HabitValuesSerializer()
+        values_fields = lean_serializer.get_values_fields()
+
+        self.assertEqual(
+            lean_serializer.to_representation(queryset.all().values(*values_fields)),
+            HabitSerializer(queryset.all(), many=True).data
+        )
+
+        # Выборка и сериализация замеряются отдельно, каждый раз на новой выборке без кэша результатов
+        timings = {'models': [0, 0], 'values': [0, 0]}
+        for _ in range(10):
+            started = time.perf_counter()
+            habits = list(queryset.all())
+            fetched = time.perf_counter()
+            HabitSerializer(habits, many=True).data
+            timings['models'][0] += fetched - started
+            timings['models'][1] += time.perf_counter() - fetched
+
+            started = time.perf_counter()
+            rows = list(queryset.all().values(*values_fields))
+            fetched = time.perf_counter()
+            lean_serializer.to_representation(rows)
+            timings['values'][0] += fetched - started
+            timings['values'][1] += time.perf_counter() - fetched
+
+        # Время зависит от машины, поэтому только выводится, без порога
+        sys.stderr.write(''.join(
+            f'\n{name}: выборка {fetch:.3f} с, сериализация {serialize:.3f} с'
+            for name, (fetch, serialize) in timings.items()
+        ) + '\n')
+
+
 class HabitListPublicTestCase(APITestCase):
     """TestCase на вывод списка публичных привычек"""
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create(
             email='test@habit.com',
             password='test',
@@ -367,8 +542,92 @@ class HabitListPublicTestCase(APITestCase):
 
         self.assertEqual(
             response.json(),
-            []
+            {
+                "count": 0,
+                "next": None,
+                "previous": None,
+                "results": []
+            }
+        )
+
+
+class HabitPublicCacheTestCase(APITestCase):
+    """TestCase на кэширование списка публичных привычек"""
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
         )
+        self.habits = [
+            Habit.objects.create(
+                owner=self.user,
+                place='Улица',
+                time='19:00:00',
+                action=f'Бег {i}',
+                is_pleasant=False,
+                period=7,
+                reward='Снижение веса',
+                length=120,
+                is_public=True
+            )
+            for i in range(10)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def get_public_actions(self):
+        response = self.client.get(reverse('habit:habit_public_list'), {'page_size': 10})
+        return [habit['action'] for habit in response.json()['results']]
+
+    def test_public_list_cache_latency(self):
+        """Benchmark холодного и прогретого запроса списка публичных привычек"""
+        url = reverse('habit:habit_public_list')
+
+        start_time = time.perf_counter()
+        cold_response = self.client.get(url)
+        cold_latency = time.perf_counter() - start_time
+
+        runs = 20
+        with self.assertNumQueries(0):
+            start_time = time.perf_counter()
+            for _ in range(runs):
+                warm_response = self.client.get(url)
+            warm_latency = (time.perf_counter() - start_time) / runs
+
+        self.assertEqual(warm_response.json(), cold_response.json())
+        # Время зависит от машины, поэтому только выводится, без порога
+        sys.stderr.write(f'\nсписок публичных привычек: холодный {cold_latency:.4f} с, прогретый {warm_latency:.4f} с\n')
+
+    def test_public_list_cache_per_scheme(self):
+        """Test на отдельный кэш для другой схемы: ссылки next и previous в ответе абсолютные"""
+        url = reverse('habit:habit_public_list')
+
+        http_next = self.client.get(url, {'page_size': 5}).json()['next']
+        https_next = self.client.get(url, {'page_size': 5}, secure=True).json()['next']
+
+        self.assertTrue(http_next.startswith('http://'))
+        self.assertTrue(https_next.startswith('https://'))
+
+    def test_public_list_cache_invalidation(self):
+        """Test на сброс кэша при создании, изменении, снятии с публикации и удалении привычки"""
+        self.assertEqual(len(self.get_public_actions()), 10)
+
+        habit = Habit.objects.get(pk=self.habits[0].pk)
+        habit.action = 'Плавание'
+        habit.save()
+        self.assertIn('Плавание', self.get_public_actions())
+
+        habit.is_public = False
+        habit.save()
+        self.assertNotIn('Плавание', self.get_public_actions())
+
+        Habit.objects.get(pk=self.habits[1].pk).delete()
+        self.assertNotIn('Бег 1', self.get_public_actions())
+
+        self.habits[2].is_public = False
+        self.habits[2].save()
+        self.assertNotIn('Бег 2', self.get_public_actions())
 
 
 class HabitRetrieveTestCase(APITestCase):
@@ -419,6 +678,8 @@ class HabitRetrieveTestCase(APITestCase):
                 "length": self.habit.length,
                 "is_public": self.habit.is_public,
                 "last_dispatch_time": None,
+                "next_dispatch_at": self.habit.next_dispatch_at.isoformat().replace('+00:00', 'Z'),
+                "updated_at": self.habit.updated_at.isoformat().replace('+00:00', 'Z'),
                 "owner": self.habit.owner.pk,
                 "linked": self.habit.linked
             }
@@ -478,7 +739,1275 @@ class HabitUpdateTestCase(APITestCase):
                 "length": 30,
                 "is_public": self.habit.is_public,
                 "last_dispatch_time": None,
+                "next_dispatch_at": self.habit.next_dispatch_at.isoformat().replace('+00:00', 'Z'),
+                "updated_at": Habit.objects.get(pk=self.habit.pk).updated_at.isoformat().replace('+00:00', 'Z'),
                 "owner": self.habit.owner.pk,
                 "linked": self.habit.linked
             }
         )
+
+
+class HabitValidatorTestCase(APITestCase):
+    """TestCase на проверку правил привычки"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.pleasant_habit = Habit.objects.create(
+            owner=self.user,
+            place='Дом',
+            time='20:00',
+            action='Чай',
+            is_pleasant=True,
+            period=1,
+            length=60,
+            is_public=False
+        )
+        self.habit = Habit.objects.create(
+            owner=self.user,
+            place='Улица',
+            time='19:00',
+            action='Бег',
+            is_pleasant=False,
+            period=1,
+            reward='Отдых',
+            length=120,
+            is_public=False
+        )
+
+    def test_habit_validator_errors_order(self):
+        """Test на вывод всех ошибок в порядке правил"""
+        errors = habit_validator.validate({
+            'reward': 'Отдых',
+            'linked': self.habit,
+            'length': 130,
+            'is_pleasant': True,
+            'period': 0,
+        })
+
+        self.assertEqual(errors, [
+            'Нельзя выбрать одновременно связанную привычку и вознаграждение!',
+            'Время выполнения должно быть не больше 120 секунд!',
+            'В связанные привычки могут попадать только привычки с признаком приятной привычки!',
+            'У приятной привычки не может быть вознаграждения или связанной привычки!',
+            'Периодичность не может быть меньше 1!',
+        ])
+        self.assertEqual(HabitValidator(rules=[validate_period]).validate({'period': 8}), [
+            'Нельзя выполнять привычку реже, чем 1 раз в 7 дней!'
+        ])
+        self.assertEqual(len(HABIT_RULES), 5)
+
+    def test_habit_partial_update_merges_instance(self):
+        """Test на проверку частичного обновления вместе с сохраненными полями привычки"""
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.patch(
+            reverse('habit:habit_update', args=[self.habit.pk]),
+            {'linked': self.pleasant_habit.pk},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {
+            'non_field_errors': ['Нельзя выбрать одновременно связанную привычку и вознаграждение!']
+        })
+
+        response = self.client.patch(
+            reverse('habit:habit_update', args=[self.habit.pk]),
+            {'linked': self.pleasant_habit.pk, 'reward': ''},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_habit_validate_many(self):
+        """Test на проверку пакета привычек с загрузкой связанных привычек одним запросом"""
+        self.habit.reward = None
+        self.habit.linked = self.pleasant_habit
+        self.habit.save()
+        instance = Habit.objects.get(pk=self.habit.pk)
+
+        with self.assertNumQueries(1):
+            errors = habit_validator.validate_many(
+                [
+                    {'linked': self.pleasant_habit.pk, 'length': 60, 'is_pleasant': False, 'period': 1},
+                    {'linked': self.habit.pk, 'length': 60, 'is_pleasant': False, 'period': 1},
+                    {'reward': 'Отдых'},
+                ],
+                [None, None, instance],
+            )
+
+        self.assertEqual(errors, [
+            [],
+            ['В связанные привычки могут попадать только привычки с признаком приятной привычки!'],
+            ['Нельзя выбрать одновременно связанную привычку и вознаграждение!'],
+        ])
+
+    def test_habit_admin_form(self):
+        """Test на проверку правил привычки в админке"""
+        form = HabitAdminForm(instance=self.habit, data={
+            'owner': self.user.pk,
+            'place': 'Улица',
+            'time': '19:00',
+            'action': 'Бег',
+            'period': 1,
+            'reward': 'Отдых',
+            'length': 120,
+            'is_pleasant': True,
+        })
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors(), [
+            'У приятной привычки не может быть вознаграждения или связанной привычки!'
+        ])
+
+
+class HabitOwnerLookupTestCase(APITestCase):
+    """TestCase на поиск привычки одним запросом среди привычек владельца"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.other_user = User.objects.create(
+            email='other@habit.com',
+            password='test',
+            tg_username='other'
+        )
+        self.habit = Habit.objects.create(
+            owner=self.user,
+            place='Улица',
+            time='19:00',
+            action='Бег',
+            is_pleasant=False,
+            period=1,
+            reward='Отдых',
+            length=120,
+            is_public=False
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_habit_retrieve_queries(self):
+        """Test на запросы при выводе привычки: одна выборка привычки, по ней же строится ETag"""
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('habit:habit_detail', args=[self.habit.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_habit_update_queries(self):
+        """Test на запросы при обновлении привычки: поиск привычки и запись изменений"""
+        with self.assertNumQueries(2):
+            response = self.client.patch(reverse('habit:habit_update', args=[self.habit.pk]), {'action': 'Плавание'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_habit_destroy_queries(self):
+        """Test на запросы при удалении привычки: поиск привычки, поиск ссылающихся на нее привычек
+        и удаление со связанными записями"""
+        with self.assertNumQueries(5):
+            response = self.client.delete(reverse('habit:habit_delete', args=[self.habit.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_habit_foreign_not_found(self):
+        """Test на недоступность чужой привычки без загрузки ее владельца"""
+        self.client.force_authenticate(user=self.other_user)
+
+        with self.assertNumQueries(1):
+            response = self.client.patch(reverse('habit:habit_update', args=[self.habit.pk]), {'action': 'Плавание'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.assertNumQueries(1):
+            response = self.client.delete(reverse('habit:habit_delete', args=[self.habit.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(reverse('habit:habit_detail', args=[self.habit.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Habit.objects.filter(pk=self.habit.pk, action='Бег').exists())
+
+
+class HabitWriteQueriesTestCase(APITestCase):
+    """TestCase на одну запись в базу при создании и обновлении привычки"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.other_user = User.objects.create(
+            email='other@habit.com',
+            password='test',
+            tg_username='other'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def get_writes(self, queries):
+        return [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+
+    def test_habit_create_single_insert(self):
+        """Test на создание привычки одним INSERT с владельцем из запроса"""
+        data = {
+            'owner': self.other_user.pk,
+            'place': 'Дом',
+            'time': '07:00',
+            'action': 'Зарядка',
+            'is_pleasant': False,
+            'period': 1,
+            'reward': 'Кофе',
+            'length': 60,
+            'is_public': False
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('habit:habit_create'), data=data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.get_writes(queries)), 1)
+        self.assertEqual(Habit.objects.get(pk=response.json()['id']).owner, self.user)
+
+    def test_habit_update_changed_fields_only(self):
+        """Test на обновление привычки одним UPDATE только измененных полей"""
+        habit = Habit.objects.create(
+            owner=self.user,
+            place='Улица',
+            time='19:00:00',
+            action='Бег',
+            is_pleasant=False,
+            period=7,
+            reward='Снижение веса',
+            length=120,
+            is_public=False
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(reverse('habit:habit_update', args=[habit.pk]), data={'action': 'Плавание'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = self.get_writes(queries)
+        self.assertEqual(len(writes), 1)
+        self.assertIn('"action"', writes[0])
+        self.assertNotIn('"place"', writes[0])
+
+
+class HabitBulkTestCase(APITestCase):
+    """TestCase на пакетные операции с привычками"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.pleasant_habits = [
+            Habit.objects.create(
+                owner=self.user,
+                place='Дом',
+                time='20:00:00',
+                action=f'Ванна {i}',
+                is_pleasant=True,
+                period=1,
+                length=60,
+                is_public=False
+            )
+            for i in range(3)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def get_habit_data(self, **kwargs):
+        return {
+            'place': 'Улица',
+            'time': '07:00',
+            'action': 'Бег',
+            'is_pleasant': False,
+            'period': 1,
+            'length': 60,
+            'is_public': False,
+            **kwargs
+        }
+
+    def test_habit_bulk_create(self):
+        """Test на пакетное создание привычек с загрузкой связанных привычек одним запросом"""
+        data = [self.get_habit_data(action=f'Бег {i}', linked=habit.pk) for i, habit in enumerate(self.pleasant_habits)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('habit:habit_bulk_create'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([habit['linked'] for habit in response.json()], [habit.pk for habit in self.pleasant_habits])
+        self.assertEqual(Habit.objects.filter(owner=self.user, is_pleasant=False).count(), 3)
+
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(len(inserts), 1)
+
+    def test_habit_bulk_create_item_errors(self):
+        """Test на ошибки по каждой привычке и отсутствие частичного создания"""
+        data = [self.get_habit_data(), self.get_habit_data(period=10), self.get_habit_data(linked=0)]
+
+        response = self.client.post(reverse('habit:habit_bulk_create'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertNotIn('0', errors)
+        self.assertEqual(errors['1'], {'non_field_errors': ['Нельзя выполнять привычку реже, чем 1 раз в 7 дней!']})
+        self.assertIn('linked', errors['2'])
+        self.assertFalse(Habit.objects.filter(is_pleasant=False).exists())
+
+    def test_habit_bulk_update(self):
+        """Test на пакетное обновление привычек только владельца"""
+        other_user = User.objects.create(email='other@habit.com', tg_username='other')
+        other_habit = Habit.objects.create(owner=other_user, **self.get_habit_data(time='07:00:00'))
+
+        data = [{'id': habit.pk, 'place': 'Баня'} for habit in self.pleasant_habits]
+        response = self.client.patch(reverse('habit:habit_bulk_update'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Habit.objects.filter(place='Баня').count(), 3)
+
+        data = [{'id': self.pleasant_habits[0].pk, 'place': 'Дом'}, {'id': other_habit.pk, 'place': 'Дом'}]
+        response = self.client.patch(reverse('habit:habit_bulk_update'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'1': {'id': ['Привычка не найдена.']}})
+        self.assertFalse(Habit.objects.filter(place='Дом').exists())
+
+    def test_habit_bulk_delete(self):
+        """Test на пакетное удаление привычек только владельца"""
+        other_user = User.objects.create(email='other@habit.com', tg_username='other')
+        other_habit = Habit.objects.create(owner=other_user, **self.get_habit_data(time='07:00:00'))
+
+        data = {'ids': [self.pleasant_habits[0].pk, self.pleasant_habits[1].pk, other_habit.pk]}
+        response = self.client.post(reverse('habit:habit_bulk_delete'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'deleted': 2})
+        self.assertTrue(Habit.objects.filter(pk=other_habit.pk).exists())
+        self.assertEqual(Habit.objects.filter(owner=self.user).count(), 1)
+
+    def test_habit_bulk_delete_with_outbox(self):
+        """Test на количество удаленных привычек без учета их уведомлений в очереди"""
+        for habit in self.pleasant_habits[:2]:
+            for _ in range(2):
+                NotificationOutbox.objects.create(habit=habit, chat_id=1, text='test', next_attempt_at=timezone.now())
+
+        data = {'ids': [self.pleasant_habits[0].pk, self.pleasant_habits[1].pk]}
+        response = self.client.post(reverse('habit:habit_bulk_delete'), data=data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'deleted': 2})
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+
+class HabitExportTestCase(APITestCase):
+    """TestCase на потоковую выгрузку привычек"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.other_user = User.objects.create(
+            email='other@habit.com',
+            password='test',
+            tg_username='other'
+        )
+        self.admin = User.objects.create(
+            email='admin@habit.com',
+            password='test',
+            tg_username='admin',
+            is_staff=True
+        )
+        self.habits = [
+            Habit.objects.create(
+                owner=self.user,
+                place='Улица',
+                time='19:00',
+                action=f'Бег {number}',
+                is_pleasant=True,
+                period=1,
+                length=120,
+                is_public=False,
+            )
+            for number in range(3)
+        ]
+        Habit.objects.create(
+            owner=self.other_user,
+            place='Дом',
+            time='08:00',
+            action='Зарядка',
+            is_pleasant=True,
+            period=1,
+            length=60,
+            is_public=False,
+        )
+
+    def get_content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_habit_export_ndjson(self):
+        """Тест выгрузки собственных привычек в NDJSON"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_export'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response.headers['Content-Type'], 'application/x-ndjson')
+
+        rows = [json.loads(line) for line in self.get_content(response).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [habit.pk for habit in self.habits])
+        self.assertEqual(rows[0], self.client.get(reverse('habit:habit_detail', args=[self.habits[0].pk])).json())
+
+    def test_habit_export_csv(self):
+        """Тест выгрузки собственных привычек в CSV"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_export'), {'export_format': 'csv'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers['Content-Type'], 'text/csv')
+        self.assertIn('filename="habits.csv"', response.headers['Content-Disposition'])
+
+        lines = self.get_content(response).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('id,'))
+        self.assertIn('Бег 0', lines[1])
+
+    def test_habit_export_chunked_queries(self):
+        """Тест чтения привычек порциями без дополнительных запросов на каждую привычку"""
+        self.client.force_authenticate(user=self.user)
+
+        with override_settings(HABIT_EXPORT_CHUNK_SIZE=1):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('habit:habit_export'))
+                self.get_content(response)
+
+        self.assertEqual(len([query for query in queries if 'habit_habit' in query['sql']]), 1)
+
+    def test_habit_export_single_serializer(self):
+        """Тест построения полей сериализатора один раз на выгрузку, а не для каждой привычки"""
+        self.client.force_authenticate(user=self.user)
+
+        with patch.object(HabitSerializer, 'get_fields', autospec=True, side_effect=HabitSerializer.get_fields) as mock:
+            rows = self.get_content(self.client.get(reverse('habit:habit_export'))).splitlines()
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(mock.call_count, 1)
+
+    def test_habit_export_all(self):
+        """Тест выгрузки всех привычек администратором"""
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(reverse('habit:habit_export'), {'all': 'true'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.get_content(response).splitlines()), 4)
+
+    def test_habit_export_all_forbidden(self):
+        """Тест запрета выгрузки всех привычек обычному пользователю"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_export'), {'all': 'true'})
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_habit_export_invalid_format(self):
+        """Тест выгрузки в неподдерживаемом формате"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_export'), {'export_format': 'xml'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HabitImportTestCase(APITestCase):
+    """TestCase на импорт привычек командой import_habits"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test',
+            timezone='Europe/Moscow'
+        )
+        self.pleasant_habit = Habit.objects.create(
+            owner=self.user,
+            place='Дом',
+            time='20:00',
+            action='Чай',
+            is_pleasant=True,
+            period=1,
+            length=60,
+            is_public=False
+        )
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def make_record(self, number, **kwargs):
+        record = {
+            'owner': 'test@habit.com',
+            'place': 'Улица',
+            'time': '19:00',
+            'action': f'Бег {number}',
+            'is_pleasant': False,
+            'period': 1,
+            'length': 120,
+            'is_public': False,
+        }
+        record.update(kwargs)
+        return record
+
+    def write_ndjson(self, records):
+        path = os.path.join(self.tmp_dir.name, 'habits.ndjson')
+        with open(path, 'w', encoding='utf-8') as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return path
+
+    def import_habits(self, path, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_habits', path, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_habits_ndjson(self):
+        """Тест импорта привычек из NDJSON с проверкой теми же правилами, что и в API"""
+        path = self.write_ndjson([
+            self.make_record(0, linked=self.pleasant_habit.pk),
+            self.make_record(1, period=8),
+            self.make_record(2, owner='missing@habit.com'),
+            self.make_record(3, reward='Отдых'),
+        ])
+
+        stdout, stderr = self.import_habits(path, batch_size=2, linked_by_pk=True)
+
+        self.assertEqual(
+            list(Habit.objects.filter(action__startswith='Бег').values_list('action', flat=True)),
+            ['Бег 0', 'Бег 3']
+        )
+        habit = Habit.objects.get(action='Бег 0')
+        self.assertEqual(habit.linked, self.pleasant_habit)
+        self.assertEqual(habit.next_dispatch_at, habit.calc_next_dispatch_at())
+        self.assertIn('Запись 2: {"non_field_errors": ["Нельзя выполнять привычку реже, чем 1 раз в 7 дней!"]}', stderr)
+        self.assertIn('Запись 3: {"owner": ["Пользователь не найден."]}', stderr)
+        self.assertIn('Обработано записей: 2, создано привычек: 1, с ошибками: 1', stdout)
+        self.assertIn('Импорт завершен: создано привычек 2, с ошибками 2', stdout)
+
+    def test_import_habits_csv_export(self):
+        """Тест импорта привычек из CSV-выгрузки"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('habit:habit_export'), {'export_format': 'csv'})
+        path = os.path.join(self.tmp_dir.name, 'habits.csv')
+        with open(path, 'wb') as file:
+            file.write(b''.join(response.streaming_content))
+
+        self.import_habits(path)
+
+        habits = Habit.objects.filter(action='Чай')
+        self.assertEqual(habits.count(), 2)
+        self.assertEqual({habit.owner for habit in habits}, {self.user})
+
+    def test_import_habits_checkpoint(self):
+        """Тест продолжения импорта с сохраненного прогресса"""
+        path = self.write_ndjson([self.make_record(number) for number in range(5)])
+        checkpoint = os.path.join(self.tmp_dir.name, 'checkpoint.json')
+        with open(checkpoint, 'w') as file:
+            json.dump({'processed': 3}, file)
+
+        self.import_habits(path, batch_size=1, checkpoint=checkpoint)
+
+        self.assertEqual(
+            list(Habit.objects.filter(action__startswith='Бег').values_list('action', flat=True)),
+            ['Бег 3', 'Бег 4']
+        )
+        with open(checkpoint) as file:
+            self.assertEqual(json.load(file), {'processed': 5, 'ids': {}})
+
+    def test_import_habits_linked_source_ids(self):
+        """Тест связи привычек по id записей из файла, а не по id привычек в базе"""
+        path = self.write_ndjson([
+            self.make_record(0, id=101, linked=100),
+            self.make_record(1, id=100, is_pleasant=True, length=60),
+            self.make_record(2, id=102, linked=100),
+            self.make_record(3, id=103, linked=self.pleasant_habit.pk),
+        ])
+        checkpoint = os.path.join(self.tmp_dir.name, 'checkpoint.json')
+
+        _, stderr = self.import_habits(path, batch_size=2, checkpoint=checkpoint)
+
+        linked = Habit.objects.get(action='Бег 1')
+        self.assertEqual(Habit.objects.get(action='Бег 0').linked, linked)
+        self.assertEqual(Habit.objects.get(action='Бег 2').linked, linked)
+        self.assertFalse(Habit.objects.filter(action='Бег 3').exists())
+        self.assertIn('Запись 4: {"linked": ["Связанная привычка не найдена среди импортированных записей."]}', stderr)
+        with open(checkpoint) as file:
+            self.assertEqual(json.load(file)['ids']['100'], linked.pk)
+
+    def test_import_habits_create_users(self):
+        """Тест создания недостающих владельцев при импорте"""
+        path = self.write_ndjson([
+            self.make_record(0, owner='new@habit.com', tg_username='new', timezone='Asia/Tokyo'),
+            self.make_record(1, owner='new@habit.com'),
+            self.make_record(2, owner='bad@habit.com', timezone='Mars/Olympus'),
+        ])
+
+        _, stderr = self.import_habits(path, create_users=True)
+
+        user = User.objects.get(email='new@habit.com')
+        self.assertEqual((user.tg_username, user.timezone), ('new', 'Asia/Tokyo'))
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(Habit.objects.filter(owner=user).count(), 2)
+        self.assertFalse(User.objects.filter(email='bad@habit.com').exists())
+        self.assertIn('Запись 3: {"timezone": ["Неизвестный часовой пояс: Mars/Olympus"]}', stderr)
+
+    def test_import_habits_invalid_records(self):
+        """Тест продолжения импорта после строк с некорректным JSON и записей, не являющихся объектами"""
+        path = os.path.join(self.tmp_dir.name, 'habits.ndjson')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(self.make_record(0), ensure_ascii=False) + '\n')
+            file.write('{"owner": "test@habit.com",\n')
+            file.write('[1, 2]\n')
+            file.write(json.dumps(self.make_record(3), ensure_ascii=False) + '\n')
+
+        stdout, stderr = self.import_habits(path, batch_size=10)
+
+        self.assertEqual(
+            list(Habit.objects.filter(action__startswith='Бег').values_list('action', flat=True)),
+            ['Бег 0', 'Бег 3']
+        )
+        self.assertIn('Запись 2: {"non_field_errors": ["Некорректный JSON:', stderr)
+        self.assertIn('Запись 3: {"non_field_errors":', stderr)
+        self.assertIn('создано привычек 2, с ошибками 2', stdout)
+
+    def test_import_habits_benchmark(self):
+        """Тест производительности импорта: число запросов зависит только от количества порций"""
+        path = self.write_ndjson([
+            self.make_record(number, owner=f'user{number % 10}@habit.com', linked=self.pleasant_habit.pk)
+            for number in range(1000)
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.import_habits(path, batch_size=250, create_users=True, linked_by_pk=True)
+
+        self.assertEqual(Habit.objects.filter(action__startswith='Бег').count(), 1000)
+        # На порцию: связанные привычки, владельцы, точка сохранения и ее освобождение, вставка привычек
+        # запросами по bulk_batch_size базы; владельцы создаются один раз в первой порции
+        habit_fields = [field for field in Habit._meta.concrete_fields if not field.primary_key]
+        user_fields = [field for field in User._meta.concrete_fields if not field.primary_key]
+        habit_inserts = math.ceil(250 / connection.ops.bulk_batch_size(habit_fields, [None] * 250))
+        user_inserts = math.ceil(10 / connection.ops.bulk_batch_size(user_fields, [None] * 10))
+        self.assertLessEqual(len(queries), 4 * (4 + habit_inserts) + user_inserts)
+
+
+class HabitConditionalGetTestCase(APITestCase):
+    """TestCase на условные GET-запросы к привычкам"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.habit = Habit.objects.create(
+            owner=self.user,
+            place='Улица',
+            time='19:00:00',
+            action='Бег',
+            is_pleasant=False,
+            period=7,
+            reward='Снижение веса',
+            length=120,
+            is_public=False
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def assert_not_modified(self, url):
+        """Проверка ответа 304 по ETag и Last-Modified без выборки привычек"""
+        # Last-Modified отдается только после окончания секунды изменения
+        Habit.objects.update(updated_at=timezone.now() - timedelta(seconds=2))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response.headers)
+        self.assertIn('Last-Modified', response.headers)
+
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response.headers['Last-Modified'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        return response.headers['ETag']
+
+    def test_habit_list_etag(self):
+        """Test на ETag списка привычек и его смену при изменении, создании и удалении"""
+        url = reverse('habit:habit_list')
+        etag = self.assert_not_modified(url)
+
+        self.habit.action = 'Плавание'
+        self.habit.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers['ETag']
+
+        Habit.objects.create(
+            owner=self.user,
+            place='Дом',
+            time='07:00:00',
+            action='Зарядка',
+            is_pleasant=True,
+            period=1,
+            length=60,
+            is_public=False
+        ).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.habit.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_habit_retrieve_etag(self):
+        """Test на ETag привычки и его смену при изменении"""
+        url = reverse('habit:habit_detail', args=[self.habit.pk])
+        etag = self.assert_not_modified(url)
+
+        self.habit.action = 'Плавание'
+        self.habit.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_habit_retrieve_linked_deleted(self):
+        """Test на смену ETag привычки при удалении связанной привычки"""
+        pleasant_habit = Habit.objects.create(
+            owner=self.user,
+            place='Дом',
+            time='20:00:00',
+            action='Ванна',
+            is_pleasant=True,
+            period=7,
+            length=60,
+            is_public=False
+        )
+        self.habit.reward = None
+        self.habit.linked = pleasant_habit
+        self.habit.save()
+        url = reverse('habit:habit_detail', args=[self.habit.pk])
+        etag = self.assert_not_modified(url)
+        last_modified = self.client.get(url).headers['Last-Modified']
+
+        pleasant_habit.delete()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.json()['linked'])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_habit_last_modified_current_second(self):
+        """Test на отсутствие Last-Modified, пока секунда изменения привычки не закончилась"""
+        url = reverse('habit:habit_detail', args=[self.habit.pk])
+        Habit.objects.update(updated_at=timezone.now() + timedelta(seconds=1))
+
+        response = self.client.get(url)
+        self.assertIn('ETag', response.headers)
+        self.assertNotIn('Last-Modified', response.headers)
+
+
+class HabitIndexTestCase(APITestCase):
+    """TestCase на использование индексов при выводе списков привычек"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+
+    def get_plan(self, queryset):
+        """План выполнения запроса с отключенным последовательным сканированием"""
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется только на PostgreSQL')
+    def test_owner_list_uses_index(self):
+        """Test на использование индекса (owner, id) для списка привычек владельца"""
+        plan = self.get_plan(Habit.objects.filter(owner=self.user)[:5])
+
+        self.assertIn('habit_owner_id_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется только на PostgreSQL')
+    def test_public_list_uses_index(self):
+        """Test на использование частичного индекса для списка публичных привычек"""
+        plan = self.get_plan(Habit.objects.filter(is_public=True)[:5])
+
+        self.assertIn('habit_public_id_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+
+class HabitNotificationTestCase(APITestCase):
+    """TestCase на рассылку уведомлений о привычках"""
+    def setUp(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test',
+            tg_chat_id=1
+        )
+        self.due_habit = Habit.objects.create(
+            owner=self.user,
+            place='Улица',
+            time='00:00:00',
+            action='Бег',
+            is_pleasant=False,
+            period=1,
+            reward='Снижение веса',
+            length=120,
+            is_public=False
+        )
+        self.not_due_habit = Habit.objects.create(
+            owner=self.user,
+            place='Дом',
+            time='00:00:00',
+            action='Зарядка',
+            is_pleasant=False,
+            period=7,
+            reward='Снижение веса',
+            length=120,
+            is_public=False,
+            last_dispatch_time=timezone.now() - timedelta(days=1)
+        )
+
+    def test_next_dispatch_at(self):
+        """Test на расчет времени следующей отправки"""
+        self.assertEqual(
+            self.not_due_habit.next_dispatch_at,
+            datetime.combine(
+                self.not_due_habit.last_dispatch_time.date() + timedelta(days=7),
+                datetime.min.time(),
+                tzinfo=dt_timezone.utc
+            )
+        )
+        self.assertLessEqual(self.due_habit.next_dispatch_at, timezone.now())
+
+    def test_next_dispatch_at_owner_timezone(self):
+        """Test на расчет времени следующей отправки в часовом поясе владельца"""
+        self.user.timezone = 'Asia/Vladivostok'
+        self.not_due_habit.time = '09:00:30'
+        self.not_due_habit.save()
+
+        next_dispatch_at = self.not_due_habit.next_dispatch_at.astimezone(dt_timezone.utc)
+        self.assertEqual((next_dispatch_at.hour, next_dispatch_at.minute, next_dispatch_at.second), (23, 0, 0))
+
+    @patch('habit.services.TelegramClient.send_message', return_value=True)
+    def test_send_only_due_habits(self, send_message_mock):
+        """Test на отправку уведомлений только по наступившим привычкам"""
+        send_notification_tg()
+
+        self.assertEqual(send_message_mock.call_count, 1)
+        chat_id, text, _ = send_message_mock.call_args.args
+        self.assertEqual(chat_id, self.user.tg_chat_id)
+        self.assertIn(self.due_habit.action, text)
+
+        self.due_habit.refresh_from_db()
+        self.assertIsNotNone(self.due_habit.last_dispatch_time)
+        self.assertEqual(
+            self.due_habit.next_dispatch_at.date(),
+            self.due_habit.last_dispatch_time.date() + timedelta(days=1)
+        )
+
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.habit, self.due_habit)
+        self.assertEqual(notification.status, NotificationOutbox.STATUS_SENT)
+        self.assertIsNotNone(notification.sent_at)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2, NOTIFICATION_RETRY_BACKOFF=60)
+    @patch('habit.services.TelegramClient.send_message', return_value=False)
+    def test_failed_delivery_retry_and_dead_letter(self, send_message_mock):
+        """Test на повтор недоставленного уведомления с задержкой и перевод в недоставленные"""
+        send_notification_tg()
+
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.status, NotificationOutbox.STATUS_PENDING)
+        self.assertEqual(notification.attempts, 1)
+        self.assertGreater(notification.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+        deliver_notifications()
+        self.assertEqual(send_message_mock.call_count, 1)
+
+        NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+        deliver_notifications()
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationOutbox.STATUS_DEAD)
+        self.assertEqual(notification.attempts, 2)
+
+    @patch('habit.services.TelegramClient.send_message', return_value=True)
+    def test_skip_owner_without_chat_id(self, send_message_mock):
+        """Test на то, что привычки пользователей без tg_chat_id не выбираются из базы"""
+        self.user.tg_chat_id = None
+        self.user.save()
+
+        send_notification_tg()
+
+        send_message_mock.assert_not_called()
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def create_due_habits(self, count):
+        """Создание привычек с наступившим временем отправки у разных пользователей"""
+        for i in range(count):
+            user = User.objects.create(email=f'test{i}@habit.com', tg_username=f'test{i}', tg_chat_id=i + 10)
+            Habit.objects.create(
+                owner=user,
+                place='Улица',
+                time='00:00:00',
+                action='Бег',
+                is_pleasant=False,
+                period=1,
+                reward='Снижение веса',
+                length=120,
+                is_public=False
+            )
+
+    @patch('habit.services.TelegramClient.send_message', return_value=True)
+    def test_dispatch_query_count(self, client_send_mock):
+        """Test на постоянное число запросов к базе независимо от количества привычек"""
+        # Постановка в очередь: SAVEPOINT, SELECT ... FOR UPDATE вместе с владельцами, INSERT, UPDATE, RELEASE
+        # Доставка: SAVEPOINT, SELECT ... FOR UPDATE, UPDATE, RELEASE и одно обновление доставленных
+        with self.assertNumQueries(5):
+            enqueue_notification_chunk(0)
+        with self.assertNumQueries(5):
+            deliver_notification_chunk(0)
+
+        self.create_due_habits(10)
+
+        with self.assertNumQueries(5):
+            enqueue_notification_chunk(0)
+        with self.assertNumQueries(5):
+            deliver_notification_chunk(0)
+
+        self.assertEqual(client_send_mock.call_count, 11)
+
+    @override_settings(HABIT_DISPATCH_BATCH_SIZE=2, NOTIFICATION_DELIVERY_BATCH_SIZE=2)
+    @patch('habit.services.TelegramClient.send_message', side_effect=[True, True, True, True, False])
+    def test_dispatch_chunks(self, client_send_mock):
+        """Test на разбиение рассылки на подзадачи и сводный результат"""
+        self.create_due_habits(4)
+        User.objects.create(email='no_chat@habit.com', tg_username='no_chat')
+        Habit.objects.create(
+            owner=User.objects.get(email='no_chat@habit.com'),
+            place='Улица',
+            time='00:00:00',
+            action='Бег',
+            is_pleasant=False,
+            period=1,
+            reward='Снижение веса',
+            length=120,
+            is_public=False
+        )
+
+        ranges = split_pk_ranges(get_due_habits(timezone.now()), 2)
+        self.assertEqual(len(ranges), 3)
+        self.assertIsNone(ranges[-1][1])
+
+        with self.assertLogs('habit.tasks', level='INFO') as logs:
+            send_notification_tg()
+
+        self.assertIn("{'queued': 5, 'skipped': 1}", logs.output[0])
+        self.assertIn("{'sent': 4, 'failed': 1, 'dead': 0}", logs.output[1])
+
+        # Привычка юзера без чата снята с отправки и больше не попадает в наступившие
+        self.assertIsNone(Habit.objects.get(owner__email='no_chat@habit.com').next_dispatch_at)
+        with self.assertLogs('habit.tasks', level='INFO') as logs:
+            send_notification_tg()
+        self.assertIn("{'queued': 0, 'skipped': 0}", logs.output[0])
+
+
+class HabitConcurrentDispatchTestCase(TransactionTestCase):
+    """TestCase на параллельные запуски рассылки"""
+    def setUp(self):
+        for i in range(20):
+            user = User.objects.create(email=f'test{i}@habit.com', tg_username=f'test{i}', tg_chat_id=i + 1)
+            Habit.objects.create(
+                owner=user,
+                place='Улица',
+                time='00:00:00',
+                action='Бег',
+                is_pleasant=False,
+                period=1,
+                reward='Снижение веса',
+                length=120,
+                is_public=False
+            )
+
+    def run_concurrently(self, task):
+        """Одновременный запуск задачи в двух потоках"""
+        barrier = threading.Barrier(2)
+
+        def run():
+            barrier.wait()
+            try:
+                task(0)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @skipUnlessDBFeature('has_select_for_update_skip_locked')
+    def test_concurrent_runs_without_duplicates(self):
+        """Test на то, что два одновременных запуска не отправляют одну привычку дважды"""
+        sent_chat_ids = []
+
+        def slow_send(chat_id, text, chat_limiter=None):
+            time.sleep(0.05)
+            sent_chat_ids.append(chat_id)
+            return True
+
+        self.run_concurrently(enqueue_notification_chunk)
+
+        self.assertEqual(NotificationOutbox.objects.count(), 20)
+        self.assertFalse(Habit.objects.filter(last_dispatch_time__isnull=True).exists())
+
+        with patch('habit.services.TelegramClient.send_message', side_effect=slow_send):
+            self.run_concurrently(deliver_notification_chunk)
+
+        self.assertEqual(sorted(sent_chat_ids), list(range(1, 21)))
+        self.assertEqual(NotificationOutbox.objects.filter(status=NotificationOutbox.STATUS_SENT).count(), 20)
+
+
+class TelegramLinkTestCase(APITestCase):
+    """TestCase на привязку telegram-чатов к юзерам"""
+    def setUp(self):
+        self.user = User.objects.create(email='test@habit.com', tg_username='test')
+        self.linked_user = User.objects.create(email='test2@habit.com', tg_username='test2', tg_chat_id=2)
+        self.client_tg = Mock()
+        self.client_tg.get_updates.return_value = [
+            {'update_id': 10, 'message': {'chat': {'id': 1, 'username': 'test'}}},
+            {'update_id': 11, 'message': {'chat': {'id': 3, 'username': 'test2'}}},
+            {'update_id': 12, 'edited_message': {'chat': {'id': 4, 'username': 'test3'}}},
+        ]
+
+    def test_link_users_chat_ids(self):
+        """Test на привязку tg_chat_id только юзерам без чата и сохранение смещения"""
+        self.assertEqual(link_users_chat_ids(self.client_tg), 1)
+
+        self.user.refresh_from_db()
+        self.linked_user.refresh_from_db()
+        self.assertEqual(self.user.tg_chat_id, 1)
+        self.assertEqual(self.linked_user.tg_chat_id, 2)
+        self.assertEqual(TelegramOffset.objects.get().update_id, 12)
+        self.client_tg.get_updates.assert_called_once_with(offset=1)
+
+    def test_link_user_registered_after_update(self):
+        """Test на привязку юзера, который написал боту до регистрации"""
+        self.user.tg_chat_id = 1
+        self.user.save()
+        self.client_tg.get_updates.return_value = [
+            {'update_id': 10, 'message': {'chat': {'id': 5, 'username': 'late'}}},
+        ]
+
+        self.assertEqual(link_users_chat_ids(self.client_tg), 0)
+        self.assertEqual(TelegramChat.objects.get(username='late').chat_id, 5)
+
+        late_user = User.objects.create(email='late@habit.com', tg_username='late')
+        self.client_tg.get_updates.return_value = []
+
+        self.assertEqual(link_users_chat_ids(self.client_tg), 1)
+        late_user.refresh_from_db()
+        self.assertEqual(late_user.tg_chat_id, 5)
+        self.client_tg.get_updates.assert_called_with(offset=11)
+
+    def test_link_resumes_skipped_habits(self):
+        """Test на возобновление отправки привычек юзера, снятых с нее до привязки чата"""
+        habit = Habit.objects.create(
+            owner=self.user,
+            place='Улица',
+            time='19:00:00',
+            action='Бег',
+            is_pleasant=False,
+            period=7,
+            reward='Снижение веса',
+            length=120,
+            is_public=False,
+            last_dispatch_time=timezone.now() - timedelta(days=30)
+        )
+        Habit.objects.filter(pk=habit.pk).update(next_dispatch_at=None)
+
+        self.assertEqual(link_users_chat_ids(self.client_tg), 1)
+
+        habit.refresh_from_db()
+        # Отправка с ближайшего времени привычки, а не с пропущенного по last_dispatch_time
+        self.assertGreater(habit.next_dispatch_at, timezone.now())
+        self.assertLessEqual(habit.next_dispatch_at, timezone.now() + timedelta(days=1))
+
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    """Заглушка Telegram Bot API: отвечает статусами из очереди server.statuses"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.client_address, self.path, json.loads(body) if body else None))
+
+        time.sleep(self.server.delay)
+        status_code = self.server.statuses.pop(0) if self.server.statuses else 200
+        response = json.dumps({'ok': status_code == 200, 'result': {}, 'parameters': {'retry_after': 1}}).encode()
+
+        try:
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+        except ConnectionError:
+            # Клиент уже закрыл соединение по таймауту
+            self.close_connection = True
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TelegramClientTestCase(SimpleTestCase):
+    """TestCase на HTTP-клиент Telegram"""
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), TelegramStubHandler)
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.client = TelegramClient(
+            'token',
+            api_url=f'http://127.0.0.1:{self.server.server_port}',
+            read_timeout=0.5,
+            backoff_factor=0,
+            workers=5,
+            rate_limit=0,
+            chat_rate_limit=20,
+        )
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_send_message_keep_alive(self):
+        """Test на отправку сообщений через одно keep-alive соединение"""
+        self.assertTrue(self.client.send_message(1, 'Привет'))
+        self.assertTrue(self.client.send_message(2, 'Пока'))
+
+        (first_address, path, payload), (second_address, _, _) = self.server.requests
+        self.assertEqual(path, '/bottoken/sendMessage')
+        self.assertEqual(payload, {'chat_id': 1, 'text': 'Привет'})
+        self.assertEqual(first_address, second_address)
+
+    def test_get_updates_retry(self):
+        """Test на повтор идемпотентного запроса при временной недоступности Telegram"""
+        self.server.statuses = [503, 502]
+
+        self.client.get_updates(offset=1)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_send_message_no_status_retry(self):
+        """Test на отсутствие повтора отправки сообщения после ответа шлюза: оно могло быть уже доставлено"""
+        self.server.statuses = [502]
+
+        self.assertFalse(self.client.send_message(1, 'Привет'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_send_message_timeout(self):
+        """Test на то, что зависший запрос прерывается по таймауту"""
+        self.server.delay = 1
+
+        self.assertFalse(self.client.send_message(1, 'Привет'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_send_message_retry_after(self):
+        """Test на ожидание retry_after после ответа 429"""
+        self.server.statuses = [429]
+
+        start_time = time.monotonic()
+        self.assertTrue(self.client.send_message(1, 'Привет'))
+
+        self.assertGreaterEqual(time.monotonic() - start_time, 1)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_send_many_concurrently(self):
+        """Test на параллельную отправку сообщений в разные чаты"""
+        self.server.delay = 0.2
+
+        start_time = time.monotonic()
+        results = self.client.send_many([(chat_id, 'Привет') for chat_id in range(5)])
+
+        self.assertEqual(results, [True] * 5)
+        self.assertLess(time.monotonic() - start_time, 0.2 * 5)
+
+    def test_send_many_chat_order(self):
+        """Test на сохранение порядка и частоты сообщений внутри одного чата"""
+        messages = [(1, 'Первое'), (2, 'Другой чат'), (1, 'Второе'), (1, 'Третье')]
+
+        start_time = time.monotonic()
+        self.assertEqual(self.client.send_many(messages), [True] * 4)
+
+        chat_texts = [payload['text'] for _, _, payload in self.server.requests if payload['chat_id'] == 1]
+        self.assertEqual(chat_texts, ['Первое', 'Второе', 'Третье'])
+        self.assertGreaterEqual(time.monotonic() - start_time, 2 / 20)
+
+    def test_send_many_shared_rate_limit(self):
+        """Test на общий лимит Telegram для двух подзадач рассылки с отдельными клиентами (процессами)"""
+        clients = [
+            TelegramClient('token', api_url=f'http://127.0.0.1:{self.server.server_port}', workers=5,
+                           rate_limit=20, chat_rate_limit=10)
+            for _ in range(2)
+        ]
+        for client in clients:
+            self.addCleanup(client.session.close)
+        chunks = [
+            [(chat_id, 'Привет') for chat_id in range(10)] + [(100, 'Общий чат')] * 3,
+            [(chat_id, 'Привет') for chat_id in range(10, 20)] + [(100, 'Общий чат')] * 3,
+        ]
+        request_times = {}
+
+        def send(client, messages):
+            self.assertEqual(client.send_many(messages), [True] * len(messages))
+
+        original_request = TelegramClient._request
+
+        def timed_request(client, method, api_method, **kwargs):
+            request_times.setdefault(kwargs['json']['chat_id'], []).append(time.monotonic())
+            return original_request(client, method, api_method, **kwargs)
+
+        with patch.object(TelegramClient, '_request', timed_request):
+            threads = [threading.Thread(target=send, args=args) for args in zip(clients, chunks)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        all_times = sorted(moment for times in request_times.values() for moment in times)
+        self.assertEqual(len(all_times), 26)
+        # 26 запросов при общем лимите 20 в секунду идут с шагом не меньше 1/20 секунды
+        # (допуск на задержку потоков между ожиданием и запросом)
+        self.assertGreaterEqual(all_times[-1] - all_times[0], 25 / 20 - 0.02)
+        # 6 сообщений в один чат из двух подзадач при лимите 10 в секунду
+        chat_times = request_times[100]
+        self.assertGreaterEqual(chat_times[-1] - chat_times[0], 5 / 10 - 0.02)
+
+    def test_retry_after_shared_pause(self):
+        """Test на то, что пауза после ответа 429 соблюдается другими клиентами (процессами)"""
+        self.server.statuses = [429]
+        other_client = TelegramClient('token', api_url=f'http://127.0.0.1:{self.server.server_port}', rate_limit=0)
+        self.addCleanup(other_client.session.close)
+
+        start_time = time.monotonic()
+        thread = threading.Thread(target=self.client.send_message, args=(1, 'Привет'))
+        thread.start()
+        while not self.server.requests:
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+        self.assertTrue(other_client.send_message(2, 'Пока'))
+        thread.join()
+
+        self.assertGreaterEqual(time.monotonic() - start_time, 1)
+        self.assertEqual(len(self.server.requests), 3)
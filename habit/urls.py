@@ -2,7 +2,8 @@ from django.urls import path
 
 from habit.apps import HabitConfig
 from habit.views import HabitListAPIView, HabitRetrieveAPIView, HabitUpdateAPIView, HabitCreateAPIView, \
-    HabitDestroyAPIView, HabitPublicListAPIView
+    HabitDestroyAPIView, HabitPublicListAPIView, HabitBulkCreateAPIView, HabitBulkUpdateAPIView, HabitBulkDestroyAPIView, \
+    HabitExportAPIView
 
 app_name = HabitConfig.name
 
@@ -13,4 +14,8 @@ urlpatterns = [
     path('habit/update/<int:pk>/', HabitUpdateAPIView.as_view(), name='habit_update'),
     path('habit/create/', HabitCreateAPIView.as_view(), name='habit_create'),
     path('habit/delete/<int:pk>/', HabitDestroyAPIView.as_view(), name='habit_delete'),
+    path('habit/bulk/create/', HabitBulkCreateAPIView.as_view(), name='habit_bulk_create'),
+    path('habit/bulk/update/', HabitBulkUpdateAPIView.as_view(), name='habit_bulk_update'),
+    path('habit/bulk/delete/', HabitBulkDestroyAPIView.as_view(), name='habit_bulk_delete'),
+    path('habit/export/', HabitExportAPIView.as_view(), name='habit_export'),
 ]
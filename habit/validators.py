@@ -1,84 +1,109 @@
 from rest_framework.exceptions import ValidationError
 
+from habit.models import Habit
+
+# Поля привычки, которые проверяют правила
+HABIT_RULE_FIELDS = ('reward', 'linked', 'length', 'is_pleasant', 'period')
+
 
-class RewardOrLinkedValidator:
-    """Валидатор на одновременное заполнение полей 'linked' и 'reward'"""
-    def __init__(self, reward, linked):
-        self.reward = reward
-        self.linked = linked
+def validate_reward_or_linked(habit):
+    """Правило на одновременное заполнение полей 'linked' и 'reward'"""
+    if habit['reward'] and habit['linked']:
+        return 'Нельзя выбрать одновременно связанную привычку и вознаграждение!'
 
-    def __call__(self, value):
-        habits_reward = dict(value).get(self.reward)
-        habits_linked = dict(value).get(self.linked)
 
-        if habits_reward and habits_linked:
-            raise ValidationError('Нельзя выбрать одновременно связанную привычку и вознаграждение!')
-        elif habits_reward is None and habits_linked is None:
-            return
+def validate_execution_duration(habit):
+    """Правило на продолжительность действия 'length'"""
+    if habit['length'] is not None and int(habit['length']) > 120:
+        return 'Время выполнения должно быть не больше 120 секунд!'
 
 
-class ExecutionDurationValidator:
-    """Валидатор на продолжительность действия 'length'"""
-    def __init__(self, length):
-        self.length = length
+def validate_linked_is_pleasant(habit):
+    """Правило на то, что в связанные привычки могут попадать только привычки с признаком приятной привычки"""
+    if habit['linked'] is not None and not habit['linked'].is_pleasant:
+        return 'В связанные привычки могут попадать только привычки с признаком приятной привычки!'
 
-    def __call__(self, value):
-        habits_length = dict(value).get(self.length)
 
-        if habits_length is None:
-            return
-        elif int(habits_length) > 120:
-            raise ValidationError('Время выполнения должно быть не больше 120 секунд!')
+def validate_pleasant_habit(habit):
+    """Правило на то, что у приятной привычки не может быть вознаграждения или связанной привычки"""
+    if habit['is_pleasant'] and (habit['reward'] or habit['linked']):
+        return 'У приятной привычки не может быть вознаграждения или связанной привычки!'
 
 
-class LinkedHabitsValidator:
-    """Валидатор на то, что в связанные привычки могут попадать только привычки с признаком приятной привычки"""
-    def __init__(self, linked):
-        self.linked = linked
+def validate_period(habit):
+    """Правило на правильное задание поля 'period'"""
+    if habit['period'] is None:
+        return None
+    if int(habit['period']) > 7:
+        return 'Нельзя выполнять привычку реже, чем 1 раз в 7 дней!'
+    if int(habit['period']) < 1:
+        return 'Периодичность не может быть меньше 1!'
 
-    def __call__(self, value):
-        linked_habit = value.get(self.linked)
 
-        if linked_habit is not None:
-            if not linked_habit.is_pleasant:
-                raise ValidationError(
-                    'В связанные привычки могут попадать только привычки с признаком приятной привычки!'
-                )
-        else:
-            return
+# Правила привычки в порядке вывода ошибок
+HABIT_RULES = (
+    validate_reward_or_linked,
+    validate_execution_duration,
+    validate_linked_is_pleasant,
+    validate_pleasant_habit,
+    validate_period,
+)
 
 
-class PleasantHabitValidator:
-    """Валидатор на то, что у приятной привычки не может быть вознаграждения или связанной привычки"""
-    def __init__(self, reward, linked, is_pleasant):
-        self.reward = reward
-        self.linked = linked
-        self.is_pleasant = is_pleasant
+class HabitValidator:
+    """Валидатор привычки: все правила проверяются за один проход по данным.
 
-    def __call__(self, value):
-        pleasant_habit = dict(value).get(self.is_pleasant)
-        habits_reward = dict(value).get(self.reward)
-        habits_linked = dict(value).get(self.linked)
+    При частичном обновлении незаполненные поля берутся из привычки, а связанная привычка
+    может быть передана объектом или id.
+    """
+    requires_context = True
 
-        if pleasant_habit is None and habits_linked is None and habits_linked is None:
-            return
+    def __init__(self, rules=HABIT_RULES):
+        self.rules = rules
 
-        if pleasant_habit:
-            if habits_reward or habits_linked:
-                raise ValidationError('У приятной привычки не может быть вознаграждения или связанной привычки!')
+    def __call__(self, attrs, serializer):
+        errors = self.validate(attrs, serializer.instance)
+        if errors:
+            raise ValidationError(errors)
 
+    def merge(self, attrs, instance=None, linked_habits=None):
+        """Значения полей привычки для правил: переданные данные поверх сохраненной привычки"""
+        habit = {}
+        for field in HABIT_RULE_FIELDS:
+            if field in attrs:
+                habit[field] = attrs[field]
+            elif instance is None:
+                habit[field] = None
+            elif field == 'linked':
+                habit[field] = instance.linked_id
+                if linked_habits is None or instance.linked_id not in linked_habits:
+                    habit[field] = instance.linked
+            else:
+                habit[field] = getattr(instance, field)
 
-class PeriodValidator:
-    """Валидатор на правильное задание поля 'period'"""
-    def __init__(self, period):
-        self.period = period
+        if isinstance(habit['linked'], int):
+            if linked_habits is None:
+                linked_habits = Habit.objects.in_bulk([habit['linked']])
+            habit['linked'] = linked_habits.get(habit['linked'])
+        return habit
 
-    def __call__(self, value):
-        habits_period = dict(value).get(self.period)
+    def validate(self, attrs, instance=None, linked_habits=None):
+        """Список ошибок привычки в порядке правил"""
+        habit = self.merge(attrs, instance, linked_habits)
+        return [error for error in (rule(habit) for rule in self.rules) if error is not None]
 
-        if habits_period is None:
-            return
-        elif int(habits_period) > 7:
-            raise ValidationError('Нельзя выполнять привычку реже, чем 1 раз в 7 дней!')
-        elif int(habits_period) < 1:
-            raise ValidationError('Периодичность не может быть меньше 1!')
+    def validate_many(self, attrs_list, instances=None):
+        """Списки ошибок для каждой привычки пакета, связанные привычки загружаются одним запросом"""
+        instances = instances or [None] * len(attrs_list)
+
+        linked_pks = set()
+        for attrs, instance in zip(attrs_list, instances):
+            linked = attrs['linked'] if 'linked' in attrs else getattr(instance, 'linked_id', None)
+            if isinstance(linked, int):
+                linked_pks.add(linked)
+        linked_habits = Habit.objects.in_bulk(linked_pks)
+
+        return [self.validate(attrs, instance, linked_habits) for attrs, instance in zip(attrs_list, instances)]
+
+
+habit_validator = HabitValidator()
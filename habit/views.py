@@ -1,10 +1,23 @@
-from rest_framework import generics
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import generics, status
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
+from habit.exports import EXPORT_FORMATS, stream_export
 from habit.models import Habit
-from habit.paginators import HabitPaginator
+from habit.paginators import HabitPaginator, get_habit_paginator
 from habit.permissions import IsOwner
-from habit.serializers import HabitSerializer
+from habit.serializers import HabitBulkDeleteSerializer, HabitSerializer, HabitValuesSerializer
+from habit.services import get_public_feed_cache_key
 
 
 class HabitCreateAPIView(generics.CreateAPIView):
@@ -13,24 +26,96 @@ class HabitCreateAPIView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        new_habit = serializer.save()
-        new_habit.owner = self.request.user
-        new_habit.save()
+        serializer.save(owner=self.request.user)
 
 
-class HabitListAPIView(generics.ListAPIView):
+class HabitPaginationMixin:
+    """Выбор постраничной или курсорной пагинации для каждого запроса"""
+    pagination_class = HabitPaginator
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = get_habit_paginator(getattr(self, 'request', None))
+        return self._paginator
+
+
+class HabitValuesListMixin:
+    """Вывод списка привычек через values() без создания моделей, с выбором полей (?fields=action,time)"""
+
+    def list(self, request, *args, **kwargs):
+        fields = [name.strip() for name in request.query_params.get('fields', '').split(',') if name.strip()]
+        serializer = HabitValuesSerializer(fields)
+
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer.get_values_fields())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+
+class HabitOwnerMixin:
+    """Поиск привычки одним запросом среди привычек владельца по индексу (owner, id)"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(owner_id=self.request.user.pk)
+
+
+class HabitConditionalGetMixin:
+    """Ответ 304 Not Modified на If-None-Match / If-Modified-Since без выборки и сериализации привычек"""
+
+    def get_version(self):
+        """Версия ответа до его построения: (строка для ETag, время последнего изменения).
+
+        None - версия заранее не известна, ответ строится обычным образом (или сам вызывает conditional_response).
+        """
+        return None
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_version()
+        if version is None:
+            return super().get(request, *args, **kwargs)
+        return self.conditional_response(
+            version, lambda: super(HabitConditionalGetMixin, self).get(request, *args, **kwargs)
+        )
+
+    def conditional_response(self, version, get_response):
+        """Ответ 304 по версии или ответ get_response() с заголовками ETag и Last-Modified"""
+        etag_source, last_modified = version
+        etag = quote_etag(hashlib.md5(f'{etag_source}:{self.request.get_full_path()}'.encode()).hexdigest())
+        # Last-Modified точен до секунды: пока секунда изменения не прошла, в ней возможны новые
+        # изменения, и If-Modified-Since ошибочно дал бы 304, поэтому до ее окончания работает только ETag
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        if last_modified and last_modified >= int(timezone.now().timestamp()):
+            last_modified = None
+
+        response = get_conditional_response(self.request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get_response()
+
+        response.headers['ETag'] = etag
+        if last_modified:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class HabitListAPIView(HabitConditionalGetMixin, HabitValuesListMixin, HabitPaginationMixin, generics.ListAPIView):
     """Эндпоинт вывода списка привычек принадлежащих владельцу"""
     serializer_class = HabitSerializer
     queryset = Habit.objects.all()
     permission_classes = [IsAuthenticated]
-    pagination_class = HabitPaginator
 
     def get_queryset(self):
         return Habit.objects.filter(owner=self.request.user)
 
+    def get_version(self):
+        # Количество учитывает удаление привычек, время изменения - создание и обновление
+        version = self.get_queryset().aggregate(count=Count('id'), last_modified=Max('updated_at'))
+        return f'{self.request.user.pk}:{version["count"]}:{version["last_modified"]}', version['last_modified']
 
-class HabitPublicListAPIView(generics.ListAPIView):
-    """Эндпоинт вывода списка публичных привычек"""
+
+class HabitPublicListAPIView(HabitValuesListMixin, HabitPaginationMixin, generics.ListAPIView):
+    """Эндпоинт вывода списка публичных привычек, страницы которого кэшируются до изменения публичных привычек"""
     serializer_class = HabitSerializer
     queryset = Habit.objects.all()
     permission_classes = [IsAuthenticated]
@@ -38,27 +123,128 @@ class HabitPublicListAPIView(generics.ListAPIView):
     def get_queryset(self):
         return Habit.objects.filter(is_public=True)
 
+    def list(self, request, *args, **kwargs):
+        cache_key = get_public_feed_cache_key(request.build_absolute_uri())
+
+        data = cache.get(cache_key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, data, settings.HABIT_PUBLIC_FEED_CACHE_TIMEOUT)
+
+        return Response(data)
+
 
-class HabitRetrieveAPIView(generics.RetrieveAPIView):
+class HabitRetrieveAPIView(HabitOwnerMixin, HabitConditionalGetMixin, generics.RetrieveAPIView):
     """Эндпоинт вывода одной привычки"""
     serializer_class = HabitSerializer
     queryset = Habit.objects.all()
     permission_classes = [IsAuthenticated, IsOwner]
 
+    def retrieve(self, request, *args, **kwargs):
+        # Версия берется из загруженной привычки: и ответ 200, и 304 стоят одного запроса
+        instance = self.get_object()
+        version = f'{instance.pk}:{instance.updated_at}', instance.updated_at
+        return self.conditional_response(version, lambda: Response(self.get_serializer(instance).data))
 
-class HabitUpdateAPIView(generics.UpdateAPIView):
+
+class HabitUpdateAPIView(HabitOwnerMixin, generics.UpdateAPIView):
     """Эндпоинт обновления привычки"""
     serializer_class = HabitSerializer
-    queryset = Habit.objects.all()
+    queryset = Habit.objects.select_related('linked', 'owner')
     permission_classes = [IsAuthenticated, IsOwner]
 
-    def perform_update(self, serializer):
-        habit_update = serializer.save()
-        habit_update.owner = self.request.user
-        habit_update.save()
-
 
-class HabitDestroyAPIView(generics.DestroyAPIView):
+class HabitDestroyAPIView(HabitOwnerMixin, generics.DestroyAPIView):
     """Эндпоинт удаления привычки"""
     queryset = Habit.objects.all()
     permission_classes = [IsAuthenticated, IsOwner]
+
+
+class HabitBulkCreateAPIView(generics.CreateAPIView):
+    """Эндпоинт пакетного создания привычек"""
+    serializer_class = HabitSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer(self, *args, **kwargs):
+        return super().get_serializer(*args, many=True, max_length=settings.HABIT_BULK_MAX_SIZE, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+
+class HabitBulkUpdateAPIView(generics.GenericAPIView):
+    """Эндпоинт пакетного обновления привычек, каждая привычка в списке указывается по id"""
+    serializer_class = HabitSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Habit.objects.filter(owner=self.request.user).select_related('linked', 'owner')
+
+    def patch(self, request, *args, **kwargs):
+        pks = []
+        if isinstance(request.data, list):
+            for item in request.data:
+                try:
+                    pks.append(int(item.get('id')))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+
+        serializer = self.get_serializer(
+            list(self.get_queryset().filter(pk__in=pks)),
+            data=request.data,
+            many=True,
+            partial=True,
+            max_length=settings.HABIT_BULK_MAX_SIZE,
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data)
+
+
+class HabitBulkDestroyAPIView(generics.GenericAPIView):
+    """Эндпоинт пакетного удаления привычек по списку id"""
+    serializer_class = HabitBulkDeleteSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Habit.objects.filter(owner=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            _, deleted = self.get_queryset().filter(pk__in=serializer.validated_data['ids']).delete()
+
+        # Только привычки, без каскадно удаленных уведомлений из очереди
+        return Response({'deleted': deleted.get(Habit._meta.label, 0)}, status=status.HTTP_200_OK)
+
+
+class HabitExportAPIView(generics.GenericAPIView):
+    """Эндпоинт потоковой выгрузки привычек владельца в NDJSON или CSV (?export_format=ndjson|csv).
+
+    Администратор может выгрузить привычки всех пользователей с параметром ?all=true.
+    """
+    serializer_class = HabitSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if self.request.query_params.get('all') in ('true', '1'):
+            if not self.request.user.is_staff:
+                raise PermissionDenied('Выгрузка всех привычек доступна только администратору.')
+            return Habit.objects.order_by('pk')
+        return Habit.objects.filter(owner=self.request.user).order_by('pk')
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': [f'Поддерживаемые форматы: {", ".join(EXPORT_FORMATS)}.']})
+
+        return stream_export(
+            self.get_queryset(),
+            self.get_serializer_class(),
+            export_format,
+            settings.HABIT_EXPORT_CHUNK_SIZE,
+            'habits',
+        )
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import User
+
+# Поля юзера, которые не хранятся в кэше аутентификации
+CACHE_EXCLUDED_FIELDS = ('password',)
+
+
+def get_user_cache_key(user_id):
+    """Ключ кэша юзера, найденного по JWT-токену"""
+    return f'auth:user:{user_id}'
+
+
+def invalidate_cached_users(user_ids):
+    """Удаление юзеров из кэша аутентификации, например после изменения в обход сигналов"""
+    cache.delete_many([get_user_cache_key(user_id) for user_id in user_ids])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """Аутентификация по JWT-токену с поиском юзера в общем кэше вместо запроса к базе на каждый запрос.
+
+    Юзер хранится в кэше AUTH_USER_CACHE_TIMEOUT секунд и удаляется из него при изменении или удалении.
+    В кэш попадают значения полей без хеша пароля, пароль у восстановленного юзера загружается отложенно.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        cache_key = get_user_cache_key(user_id)
+        fields = cache.get(cache_key)
+        if fields is not None:
+            return User.from_db(User.objects.db, list(fields), list(fields.values()))
+
+        user = super().get_user(validated_token)
+        fields = {
+            field.attname: getattr(user, field.attname)
+            for field in User._meta.concrete_fields if field.attname not in CACHE_EXCLUDED_FIELDS
+        }
+        cache.set(cache_key, fields, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-хешер с числом итераций из настройки PASSWORD_HASH_ITERATIONS.
+
+    Алгоритм совпадает со стандартным, поэтому существующие пароли проверяются без изменений,
+    а при смене числа итераций хеш пересчитывается при следующем входе юзера.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or PBKDF2PasswordHasher.iterations
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+import users.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='timezone',
+            field=models.CharField(default='UTC', max_length=63, validators=[users.validators.validate_timezone], verbose_name='Часовой пояс'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from users.validators import validate_timezone
+
 NULLABLE = {'null': True, 'blank': True}
 
 
@@ -12,6 +14,8 @@ class User(AbstractUser):
 
     tg_username = models.CharField(max_length=150, verbose_name='Telegram username')
     tg_chat_id = models.IntegerField(unique=True, verbose_name='Telegram chat id', **NULLABLE)
+    timezone = models.CharField(max_length=63, default='UTC', validators=[validate_timezone],
+                                verbose_name='Часовой пояс')
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
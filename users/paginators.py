@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UserCursorPaginator(CursorPagination):
+    """Курсорный пагинатор для вывода списка юзеров: без COUNT(*) и OFFSET, поиск по первичному ключу"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = 'id'
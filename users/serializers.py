@@ -1,3 +1,4 @@
+from django.contrib.auth.hashers import make_password
 from rest_framework import serializers
 
 from users.models import User
@@ -8,3 +9,24 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
+        extra_kwargs = {'password': {'write_only': True}}
+
+    def create(self, validated_data):
+        """Создание юзера одной записью с уже захешированным паролем"""
+        validated_data['password'] = make_password(validated_data['password'])
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if 'password' in validated_data:
+            validated_data['password'] = make_password(validated_data['password'])
+        return super().update(instance, validated_data)
+
+
+class UserListSerializer(serializers.ModelSerializer):
+    """Сериализатор списка юзеров для администратора: без пароля и прав, группы загружаются заранее"""
+    groups = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+    class Meta:
+        model = User
+        fields = ('id', 'email', 'first_name', 'last_name', 'tg_username', 'tg_chat_id', 'timezone', 'is_active',
+                  'is_staff', 'is_superuser', 'date_joined', 'last_login', 'groups')
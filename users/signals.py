@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.authentication import invalidate_cached_users
+from users.models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth_cache(sender, instance, **kwargs):
+    """Сброс кэша аутентификации при изменении или удалении юзера, в том числе при смене is_active"""
+    # pk запоминается сразу: после удаления у instance он уже None
+    pk = instance.pk
+    invalidate_cached_users([pk])
+    # Повторный сброс после фиксации транзакции: параллельный запрос мог закэшировать прежнюю версию юзера
+    transaction.on_commit(lambda: invalidate_cached_users([pk]))
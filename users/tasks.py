@@ -0,0 +1,67 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from habit.models import Habit, NotificationOutbox
+from habit.services import bump_public_feed_version
+from users.models import User
+
+
+def delete_habits_batch(user_id, batch_size):
+    """Удаление одной порции привычек юзера множественными запросами без загрузки моделей.
+
+    Возвращает количество удаленных привычек и признак того, что среди них были публичные.
+    """
+    with transaction.atomic():
+        habits = list(
+            Habit.objects.filter(owner_id=user_id).order_by('pk').values_list('pk', 'is_public')[:batch_size]
+        )
+        pks = [pk for pk, _ in habits]
+        if not pks:
+            return 0, False
+
+        # Привычки других юзеров, связанные с удаляемыми, отвязываются с обновлением времени изменения
+        linked_habits = list(
+            Habit.objects.filter(linked_id__in=pks).exclude(owner_id=user_id).values_list('pk', 'is_public')
+        )
+        if linked_habits:
+            Habit.objects.filter(pk__in=[pk for pk, _ in linked_habits]).update(
+                linked=None, updated_at=timezone.now()
+            )
+        Habit.objects.filter(linked_id__in=pks).update(linked=None)
+        NotificationOutbox.objects.filter(habit_id__in=pks).delete()
+        delete_habits(pks)
+
+    return len(pks), any(is_public for _, is_public in habits + linked_habits)
+
+
+def delete_habits(pks):
+    """Удаление привычек по id одним запросом без загрузки моделей и сигналов"""
+    table = connection.ops.quote_name(Habit._meta.db_table)
+    column = connection.ops.quote_name(Habit._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {table}.{column} IN ({placeholders})', pks)
+
+
+@shared_task
+def delete_user(user_id):
+    """Удаление деактивированного юзера: привычки удаляются порциями по USER_DELETE_BATCH_SIZE, затем сам юзер"""
+    if not User.objects.filter(pk=user_id, is_active=False).exists():
+        return 0
+
+    deleted = 0
+    has_public = False
+    while True:
+        batch_deleted, batch_has_public = delete_habits_batch(user_id, settings.USER_DELETE_BATCH_SIZE)
+        if not batch_deleted:
+            break
+        deleted += batch_deleted
+        has_public |= batch_has_public
+
+    User.objects.filter(pk=user_id, is_active=False).delete()
+
+    if has_public:
+        bump_public_feed_version()
+    return deleted
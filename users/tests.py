@@ -1,8 +1,21 @@
+import json
+import sys
+import time
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from habit.models import Habit, NotificationOutbox
 from users.models import User
+from users.tasks import delete_user
 
 
 class UserTokenTestCase(APITestCase):
@@ -59,6 +72,43 @@ class UserCreateTestCase(APITestCase):
             status.HTTP_201_CREATED
         )
 
+    def test_create_user_single_write(self):
+        """Test на создание юзера одной записью с захешированным паролем и привязкой чата в Celery"""
+        data = {
+            'email': 'test1@habit.com',
+            'password': 'test',
+            'tg_username': 'test1'
+        }
+
+        with patch('users.views.link_tg_chat_ids.delay') as link_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.post(reverse('users:register'), data=data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('pbkdf2_sha256$', writes[0])
+        self.assertNotIn('password', response.json())
+        self.assertTrue(User.objects.get(email='test1@habit.com').check_password('test'))
+        link_mock.assert_called_once_with()
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_register_and_token_benchmark(self):
+        """Test на число итераций хеширования и замер времени регистрации и получения токена"""
+        with patch('users.views.link_tg_chat_ids.delay'):
+            started = time.perf_counter()
+            for number in range(5):
+                data = {'email': f'user{number}@habit.com', 'password': 'test', 'tg_username': f'user{number}'}
+                self.client.post(reverse('users:register'), data=data, format='json')
+                response = self.client.post(reverse('users:token_obtain_pair'), data=data, format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            elapsed = time.perf_counter() - started
+
+        self.assertTrue(User.objects.get(email='user0@habit.com').password.startswith('pbkdf2_sha256$1000$'))
+        # Время зависит от машины, поэтому только выводится, без порога
+        sys.stderr.write(f'\nрегистрация и токен для 5 юзеров: {elapsed:.3f} с\n')
+
 
 class UserDestroyTestCase(APITestCase):
     """TestCase на удаление юзера"""
@@ -69,21 +119,86 @@ class UserDestroyTestCase(APITestCase):
             tg_username='test3'
         )
 
+    def create_habit(self, owner, **kwargs):
+        data = {
+            'place': 'Улица',
+            'time': '19:00',
+            'action': 'Бег',
+            'is_pleasant': True,
+            'period': 1,
+            'length': 60,
+            'is_public': False,
+        }
+        data.update(kwargs)
+        return Habit.objects.create(owner=owner, **data)
+
     def test_user_delete(self):
-        """Test на удаление юзера"""
+        """Test на удаление юзера: аккаунт деактивируется, удаление передается в Celery"""
         self.client.force_authenticate(user=self.user)
 
-        response = self.client.delete(
-            reverse('users:user_delete',
-                    args=[self.user.pk])
-        )
+        with patch('users.views.delete_user.delay') as delete_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete(
+                    reverse('users:user_delete',
+                            args=[self.user.pk])
+                )
 
         self.assertEqual(
             response.status_code,
             status.HTTP_204_NO_CONTENT
         )
 
-        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(User.objects.get(id=self.user.id).is_active)
+        delete_mock.assert_called_once_with(self.user.pk)
+
+    @override_settings(USER_DELETE_BATCH_SIZE=2)
+    def test_user_delete_task(self):
+        """Test на удаление привычек юзера порциями и самого юзера"""
+        other_user = User.objects.create(email='other@habit.com', tg_username='other')
+        habits = [self.create_habit(self.user, is_public=number == 0) for number in range(5)]
+        other_habit = self.create_habit(other_user, is_pleasant=False, linked=habits[0])
+        NotificationOutbox.objects.create(habit=habits[1], chat_id=1, text='test', next_attempt_at=timezone.now())
+        self.user.is_active = False
+        self.user.save()
+
+        with patch('users.tasks.bump_public_feed_version') as bump_mock:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(delete_user(self.user.pk), 5)
+
+        # Привычки удаляются тремя порциями по id без загрузки моделей и сигналов
+        habit_deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE FROM "habit_habit"')]
+        self.assertEqual(len(habit_deletes), 3)
+        self.assertTrue(all('"habit_habit"."id" IN' in sql for sql in habit_deletes))
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Habit.objects.filter(owner_id=self.user.pk).exists())
+        self.assertFalse(NotificationOutbox.objects.exists())
+        other_habit.refresh_from_db()
+        self.assertIsNone(other_habit.linked)
+        bump_mock.assert_called_once_with()
+
+    def test_user_delete_task_active_user(self):
+        """Test на отказ от удаления снова активного юзера"""
+        self.create_habit(self.user)
+
+        self.assertEqual(delete_user(self.user.pk), 0)
+        self.assertTrue(Habit.objects.filter(owner=self.user).exists())
+
+    def test_user_delete_task_linked_public(self):
+        """Test на обновление и сброс кэша ленты для чужой публичной привычки, связанной с удаляемой"""
+        other_user = User.objects.create(email='other@habit.com', tg_username='other')
+        habit = self.create_habit(self.user)
+        other_habit = self.create_habit(other_user, is_pleasant=False, linked=habit, is_public=True)
+        updated_at = other_habit.updated_at
+        self.user.is_active = False
+        self.user.save()
+
+        with patch('users.tasks.bump_public_feed_version') as bump_mock:
+            self.assertEqual(delete_user(self.user.pk), 1)
+
+        other_habit.refresh_from_db()
+        self.assertIsNone(other_habit.linked)
+        self.assertGreater(other_habit.updated_at, updated_at)
+        bump_mock.assert_called_once_with()
 
 
 class UserListTestCase(APITestCase):
@@ -109,6 +224,54 @@ class UserListTestCase(APITestCase):
             status.HTTP_200_OK
         )
 
+        self.assertEqual(response.json()['next'], None)
+        self.assertEqual(response.json()['results'][0]['email'], 'test@habit.com')
+        self.assertNotIn('password', response.json()['results'][0])
+
+    def test_user_list_queries(self):
+        """Test на постоянное число запросов вне зависимости от количества юзеров и их групп"""
+        group = Group.objects.create(name='testers')
+        users = User.objects.bulk_create([
+            User(email=f'user{number}@habit.com', tg_username=f'user{number}') for number in range(20)
+        ])
+        for user in users:
+            user.groups.add(group)
+        self.client.force_authenticate(user=self.user)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('users:user_list'), {'page_size': 10})
+
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(response.json()['results'][1]['groups'], [group.pk])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.json()['results'][0]['email'], 'user9@habit.com')
+
+    def test_user_list_export(self):
+        """Test на потоковую выгрузку списка юзеров в NDJSON"""
+        User.objects.bulk_create([
+            User(email=f'user{number}@habit.com', tg_username=f'user{number}') for number in range(3)
+        ])
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('users:user_list'), {'export_format': 'ndjson'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['email'] for row in rows][:2], ['test@habit.com', 'user0@habit.com'])
+        self.assertEqual(len(rows), 4)
+        self.assertNotIn('password', rows[0])
+
+    def test_user_list_forbidden(self):
+        """Test на запрет вывода списка юзеров не администратору"""
+        user = User.objects.create(email='user@habit.com', tg_username='user')
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get(reverse('users:user_list'), {'export_format': 'ndjson'})
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class UserRetrieveTestCase(APITestCase):
     """TestCase на вывод профиля юзера"""
@@ -159,3 +322,153 @@ class UserUpdateTestCase(APITestCase):
         )
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_timezone_update(self):
+        """Test на пересчет времени отправки привычек после смены часового пояса"""
+        habit = Habit.objects.create(
+            owner=self.user,
+            place='Улица',
+            time='09:00:00',
+            action='Бег',
+            is_pleasant=False,
+            period=1,
+            reward='Снижение веса',
+            length=120,
+            is_public=False
+        )
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.patch(
+            reverse('users:user_update',
+                    args=[self.user.pk]),
+            data={'timezone': 'Asia/Vladivostok'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        habit.refresh_from_db()
+        self.assertEqual(habit.next_dispatch_at.hour, 23)
+
+    def test_user_invalid_timezone(self):
+        """Test на валидацию часового пояса"""
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.patch(
+            reverse('users:user_update',
+                    args=[self.user.pk]),
+            data={'timezone': 'Mars/Olympus'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserSelfLookupTestCase(APITestCase):
+    """TestCase на поиск профиля одним запросом только среди собственного профиля"""
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@habit.com',
+            password='test',
+            tg_username='test'
+        )
+        self.other_user = User.objects.create(
+            email='other@habit.com',
+            password='test',
+            tg_username='other'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_user_retrieve_queries(self):
+        """Test на запросы при выводе профиля: поиск юзера, его группы и права"""
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('users:user_detail', args=[self.user.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_update_queries(self):
+        """Test на запросы при обновлении профиля: поиск юзера, запись изменений, его группы и права"""
+        with self.assertNumQueries(4):
+            response = self.client.patch(reverse('users:user_update', args=[self.user.pk]), {'first_name': 'Test'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_foreign_not_found(self):
+        """Test на недоступность чужого профиля"""
+        for url in ('users:user_detail', 'users:user_update', 'users:user_delete'):
+            with self.assertNumQueries(1):
+                response = self.client.generic(
+                    {'users:user_detail': 'GET', 'users:user_update': 'PATCH', 'users:user_delete': 'DELETE'}[url],
+                    reverse(url, args=[self.other_user.pk]),
+                )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertTrue(User.objects.filter(pk=self.other_user.pk).exists())
+
+
+class CachedJWTAuthenticationTestCase(APITestCase):
+    """TestCase на аутентификацию по JWT-токену с кэшированием юзера"""
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email='test@habit.com',
+            tg_username='test'
+        )
+        self.user.set_password('321qwe')
+        self.user.save()
+
+        response = self.client.post(reverse('users:token_obtain_pair'), {'email': 'test@habit.com', 'password': '321qwe'})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.json()["access"]}')
+
+    def test_cached_user_queries(self):
+        """Test на отсутствие запроса юзера при повторной аутентификации"""
+        url = reverse('users:user_detail', args=[self.user.pk])
+
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cached_user_invalidation(self):
+        """Test на сброс кэша при изменении и удалении юзера"""
+        url = reverse('users:user_detail', args=[self.user.pk])
+        self.client.get(url)
+
+        response = self.client.patch(reverse('users:user_update', args=[self.user.pk]), {'first_name': 'Test'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.get(url)
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(cache.get(f'auth:user:{self.user.pk}')['first_name'], 'Test')
+
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        user.delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_user_without_password(self):
+        """Test на отсутствие хеша пароля в кэше и сохранение пароля при записи юзера из кэша"""
+        url = reverse('users:user_detail', args=[self.user.pk])
+        self.client.get(url)
+
+        cached = cache.get(f'auth:user:{self.user.pk}')
+        self.assertNotIn('password', cached)
+        self.assertNotIn(self.user.password, json.dumps(cached, default=str))
+
+        request = self.client.get(url).wsgi_request
+        request.user.first_name = 'Test'
+        request.user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('321qwe'))
+
+    def test_cached_user_delete_on_commit(self):
+        """Test на сброс кэша после фиксации транзакции удаления юзера"""
+        cache_key = f'auth:user:{self.user.pk}'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+            # Параллельный запрос успел закэшировать юзера до фиксации удаления
+            cache.set(cache_key, {'id': 1})
+
+        self.assertIsNone(cache.get(cache_key))
@@ -0,0 +1,16 @@
+from functools import lru_cache
+from zoneinfo import available_timezones
+
+from django.core.exceptions import ValidationError
+
+
+@lru_cache(maxsize=None)
+def get_available_timezones():
+    """Список поддерживаемых часовых поясов IANA"""
+    return frozenset(available_timezones())
+
+
+def validate_timezone(value):
+    """Валидатор на корректное название часового пояса"""
+    if value not in get_available_timezones():
+        raise ValidationError(f'Неизвестный часовой пояс: {value}')
@@ -1,9 +1,17 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
+from habit.exports import EXPORT_FORMATS, stream_export
+from habit.services import reschedule_habits
+from habit.tasks import link_tg_chat_ids
 from users.models import User
+from users.paginators import UserCursorPaginator
 from users.permissions import IsUser
-from users.serializers import UserSerializer
+from users.serializers import UserListSerializer, UserSerializer
+from users.tasks import delete_user
 
 
 class UserCreateAPIView(generics.CreateAPIView):
@@ -12,32 +20,74 @@ class UserCreateAPIView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         user = serializer.save()
-        user.set_password(user.password)
-        user.save()
+
+        # Привязка telegram-чата выполняется в Celery после фиксации записи юзера
+        if user.tg_chat_id is None:
+            transaction.on_commit(link_tg_chat_ids.delay)
 
 
 class UserListAPIView(generics.ListAPIView):
-    """Эндпоинт вывода списка юзеров"""
-    serializer_class = UserSerializer
-    queryset = User.objects.all()
+    """Эндпоинт вывода списка юзеров с курсорной пагинацией.
+
+    С параметром ?export_format=ndjson|csv список выгружается потоково целиком.
+    """
+    serializer_class = UserListSerializer
+    queryset = User.objects.prefetch_related('groups').order_by('pk')
     permission_classes = [IsAdminUser]
+    pagination_class = UserCursorPaginator
+
+    def list(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format')
+        if export_format is None:
+            return super().list(request, *args, **kwargs)
+
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': [f'Поддерживаемые форматы: {", ".join(EXPORT_FORMATS)}.']})
+
+        return stream_export(
+            self.get_queryset(),
+            self.get_serializer_class(),
+            export_format,
+            settings.USER_EXPORT_CHUNK_SIZE,
+            'users',
+        )
+
 
+class UserSelfMixin:
+    """Поиск юзера одним запросом только среди собственного профиля"""
 
-class UserRetrieveAPIView(generics.RetrieveAPIView):
+    def get_queryset(self):
+        return super().get_queryset().filter(pk=self.request.user.pk)
+
+
+class UserRetrieveAPIView(UserSelfMixin, generics.RetrieveAPIView):
     """Эндпоинт вывода информации о юзере"""
     serializer_class = UserSerializer
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated, IsUser]
 
 
-class UserUpdateAPIView(generics.UpdateAPIView):
+class UserUpdateAPIView(UserSelfMixin, generics.UpdateAPIView):
     """Эндпоинт обновления юзера"""
     serializer_class = UserSerializer
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated, IsUser]
 
+    def perform_update(self, serializer):
+        old_timezone = serializer.instance.timezone
+        user = serializer.save()
+
+        if user.timezone != old_timezone:
+            reschedule_habits(user)
 
-class UserDestroyAPIView(generics.DestroyAPIView):
-    """Эндпоинт удаления юзера"""
+
+class UserDestroyAPIView(UserSelfMixin, generics.DestroyAPIView):
+    """Эндпоинт удаления юзера: аккаунт сразу деактивируется, а привычки и сам юзер удаляются в Celery"""
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated, IsUser]
+
+    def perform_destroy(self, instance):
+        instance.is_active = False
+        instance.save(update_fields=['is_active'])
+
+        transaction.on_commit(lambda: delete_user.delay(instance.pk))